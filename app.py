@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Response, request, jsonify, render_template_string
 from flask_cors import CORS
 import requests
 from bs4 import BeautifulSoup
@@ -6,22 +6,359 @@ import json
 import re
 import time
 import threading
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed
 import asyncio
+import aiohttp
 import traceback
 import queue
+from urllib.parse import urlsplit
+import itertools
+import codecs
+import random
+import logging
+import logging.handlers
+import atexit
+import contextvars
+from contextlib import contextmanager
+import os
+import sqlite3
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import math
+import hashlib
+import gzip
+import argparse
+import multiprocessing
+import socket
+from requests.adapters import HTTPAdapter
+# 可选依赖：更快的JSON编码器与brotli压缩
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 # 导入bilibili-api-python库
 from bilibili_api.search import search_by_type, OrderVideo, SearchObjectType
-from bilibili_api import video
+from bilibili_api import video, select_client
 
 app = Flask(__name__)
 CORS(app)
 
-# 任务管理
-tasks = {}
+# 日志：调用线程只把日志记录放入队列，由后台监听线程格式化并写出
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')  # 'text' 或 'json'（每行一个JSON对象）
+# 逐条消息（每个视频、每次进度更新、每次匹配）的采样比例，0为关闭，1为全部输出（需 LOG_LEVEL=DEBUG）
+LOG_ITEM_SAMPLE_RATE = float(os.environ.get('LOG_ITEM_SAMPLE_RATE', '0'))
+
+logger = logging.getLogger('video_rank')
+item_logger = logger.getChild('items')
+
+# 当前执行的任务ID，附加到日志记录上；线程池与共享事件循环中的代码通过 contextvars 继承
+current_task_id = contextvars.ContextVar('current_task_id', default='-')
+
+class TaskIdFilter(logging.Filter):
+    """在调用线程中为日志记录附加任务ID"""
+    
+    def filter(self, record):
+        record.task_id = current_task_id.get()
+        return True
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps({
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'task_id': getattr(record, 'task_id', '-'),
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }, ensure_ascii=False)
+
+def setup_logging():
+    """配置非阻塞日志：QueueHandler 入队，QueueListener 在后台线程写到标准错误"""
+    if logger.handlers:
+        return
+    stream_handler = logging.StreamHandler()
+    if LOG_FORMAT == 'json':
+        stream_handler.setFormatter(JsonLogFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(
+            '%(asctime)s %(levelname)s [%(task_id)s] %(threadName)s %(name)s: %(message)s'))
+    
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(TaskIdFilter())
+    listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    logger.addHandler(queue_handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+def log_item(msg, *args):
+    """逐条消息：按 LOG_ITEM_SAMPLE_RATE 采样，关闭时不做任何格式化"""
+    if LOG_ITEM_SAMPLE_RATE <= 0 or not item_logger.isEnabledFor(logging.DEBUG):
+        return
+    if LOG_ITEM_SAMPLE_RATE >= 1 or random.random() < LOG_ITEM_SAMPLE_RATE:
+        item_logger.debug(msg, *args)
+
+setup_logging()
+
+# 任务管理：任务存储可插拔，'sqlite'（WAL模式，重启不丢失且可被多个进程共享）或 'memory'（仅当前进程）
+TASK_STORE_BACKEND = 'sqlite'
+# 数据目录（任务库、任务队列与配额账本），可通过环境变量 VIDEO_RANK_DATA_DIR 指定
+DATA_DIR = os.environ.get('VIDEO_RANK_DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+TASK_DB_PATH = os.path.join(DATA_DIR, 'tasks.db')
+TASK_TTL = 1800  # 任务保留时间（秒）
+# 多个API进程（如多个 gunicorn worker）共享同一任务存储时设为1，SSE连接才会定期检查存储
+TASK_STORE_MULTIPROCESS = os.environ.get('TASK_STORE_MULTIPROCESS', '0') == '1'
+# 原始视频中体积较大的缩略图特征字段，默认不返回，SQLite存储中与结果分开保存
+THUMBNAIL_FEATURE_FIELDS = ('thumbnail_vector', 'thumbnail_hash')
+
+def split_thumbnail_features(results):
+    """拆出原始视频的缩略图特征，返回 (不含特征的结果, 与raw列表对齐的特征列表；没有特征时为None)"""
+    raw = results.get('raw')
+    if not raw:
+        return results, None
+    stripped, features = [], []
+    for video in raw:
+        stripped.append({key: value for key, value in video.items() if key not in THUMBNAIL_FEATURE_FIELDS})
+        features.append({key: video[key] for key in THUMBNAIL_FEATURE_FIELDS if key in video})
+    return dict(results, raw=stripped), features if any(features) else None
+
+class MemoryTaskStore:
+    """进程内的任务存储"""
+    
+    shared = False  # 其他进程不可见
+    
+    def __init__(self):
+        self._tasks = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+    
+    def create(self, task):
+        with self._lock:
+            self._tasks[task['id']] = dict(task)
+            self._versions[task['id']] = 0
+    
+    def get(self, task_id, with_results=True, with_features=False):
+        """返回任务的浅拷贝，不存在时返回None（结果始终包含缩略图特征，with_features 仅为接口一致）"""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return None
+            task = dict(task)
+        if not with_results:
+            task.pop('results', None)
+        return task
+    
+    def exists(self, task_id):
+        return task_id in self._tasks
+    
+    def get_version(self, task_id):
+        return self._versions.get(task_id)
+    
+    def update(self, task_id, fields):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return False
+            task.update(fields)
+            self._versions[task_id] += 1
+            return True
+    
+    def delete(self, task_id):
+        with self._lock:
+            self._tasks.pop(task_id, None)
+            self._versions.pop(task_id, None)
+    
+    def expire(self, before):
+        """删除创建时间早于before的任务，返回被删除的任务ID"""
+        with self._lock:
+            expired = [task_id for task_id, task in self._tasks.items() if task['created_at'] < before]
+            for task_id in expired:
+                del self._tasks[task_id]
+                del self._versions[task_id]
+        return expired
+
+class SQLiteTaskStore:
+    """基于SQLite（WAL模式）的任务存储
+    
+    状态与进度为独立列，结果单独存放，其余字段以JSON保存在meta列；原始视频的缩略图特征体积较大，
+    单独存放在features列，只在需要时读取与解析。按id（主键）与created_at建索引，过期清理为一次索引删除。
+    """
+    
+    shared = True  # 其他进程可见，更新不一定能在本进程内收到通知
+    
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""CREATE TABLE IF NOT EXISTS tasks (
+            id TEXT PRIMARY KEY,
+            created_at REAL NOT NULL,
+            status TEXT,
+            progress INTEGER,
+            version INTEGER NOT NULL DEFAULT 0,
+            meta TEXT NOT NULL,
+            results BLOB,
+            features BLOB
+        )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_created_at ON tasks (created_at)")
+        # 兼容没有features列的旧任务库
+        if 'features' not in [row[1] for row in conn.execute("PRAGMA table_info(tasks)")]:
+            conn.execute("ALTER TABLE tasks ADD COLUMN features BLOB")
+    
+    def _conn(self):
+        # 每个线程使用独立连接，事务显式管理
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    def create(self, task):
+        task = dict(task)
+        results, features = split_thumbnail_features(task.pop('results', None) or {})
+        meta = {key: value for key, value in task.items() if key not in ('id', 'created_at', 'status', 'progress')}
+        self._conn().execute(
+            "INSERT INTO tasks (id, created_at, status, progress, meta, results, features) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (task['id'], task['created_at'], task.get('status'), task.get('progress'), dumps_json(meta),
+             dumps_json(results) if results else None, dumps_json(features) if features else None))
+    
+    def get(self, task_id, with_results=True, with_features=False):
+        """返回任务字典，不存在时返回None；with_features 为True时原始视频附带缩略图特征"""
+        columns = "created_at, status, progress, meta"
+        if with_results:
+            columns += ", results" + (", features" if with_features else "")
+        row = self._conn().execute(f"SELECT {columns} FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        if row is None:
+            return None
+        task = loads_json(row[3])
+        task.update(id=task_id, created_at=row[0], status=row[1])
+        if row[2] is not None:
+            task['progress'] = row[2]
+        if with_results and row[4] is not None:
+            task['results'] = loads_json(row[4])
+            if with_features and row[5] is not None:
+                for video, features in zip(task['results'].get('raw', []), loads_json(row[5])):
+                    video.update(features)
+        return task
+    
+    def exists(self, task_id):
+        return self._conn().execute("SELECT 1 FROM tasks WHERE id = ?", (task_id,)).fetchone() is not None
+    
+    def get_version(self, task_id):
+        row = self._conn().execute("SELECT version FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        return row[0] if row else None
+    
+    def update(self, task_id, fields):
+        fields = dict(fields)
+        assignments = ["version = version + 1"]
+        params = []
+        for column in ('status', 'progress'):
+            if column in fields:
+                assignments.append(f"{column} = ?")
+                params.append(fields.pop(column))
+        if 'results' in fields:
+            results, features = split_thumbnail_features(fields.pop('results'))
+            assignments.append("results = ?, features = ?")
+            params.extend([dumps_json(results), dumps_json(features) if features else None])
+        
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 其余字段合并进meta（在同一事务内读-改-写）
+            if fields:
+                row = conn.execute("SELECT meta FROM tasks WHERE id = ?", (task_id,)).fetchone()
+                if row is None:
+                    conn.execute("ROLLBACK")
+                    return False
+                meta = loads_json(row[0])
+                meta.update(fields)
+                assignments.append("meta = ?")
+                params.append(dumps_json(meta))
+            cursor = conn.execute(f"UPDATE tasks SET {', '.join(assignments)} WHERE id = ?", params + [task_id])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return cursor.rowcount > 0
+    
+    def delete(self, task_id):
+        self._conn().execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+    
+    def expire(self, before):
+        """删除创建时间早于before的任务，返回被删除的任务ID"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            expired = [row[0] for row in conn.execute("SELECT id FROM tasks WHERE created_at < ?", (before,))]
+            conn.execute("DELETE FROM tasks WHERE created_at < ?", (before,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return expired
+
+def create_task_store(backend=None):
+    backend = backend or TASK_STORE_BACKEND
+    if backend == 'sqlite':
+        return SQLiteTaskStore(TASK_DB_PATH)
+    if backend == 'memory':
+        return MemoryTaskStore()
+    raise ValueError(f"不支持的任务存储: {backend}")
+
+task_store = create_task_store()
+
+# 任务更新通知：每个任务一个条件变量，任务字段通过 update_task 修改后唤醒本进程内等待该任务的SSE连接
+_task_conditions = {}
+_task_conditions_lock = threading.Lock()
+
+def get_task_condition(task_id):
+    with _task_conditions_lock:
+        return _task_conditions.setdefault(task_id, threading.Condition())
+
+def update_task(task_id, **fields):
+    """更新任务字段并通知订阅者"""
+    condition = get_task_condition(task_id)
+    with condition:
+        task_store.update(task_id, fields)
+        condition.notify_all()
+
+def add_task_error(task_id, message):
+    """追加任务错误信息并通知订阅者"""
+    task = task_store.get(task_id, with_results=False)
+    if task is not None:
+        update_task(task_id, errors=task.get('errors', []) + [message])
+
+def forget_task(task_id):
+    """清理本进程内与任务相关的通知条件变量与响应缓存"""
+    discard_completed_payloads(task_id)
+    with _task_conditions_lock:
+        _task_conditions.pop(task_id, None)
+
+def discard_task(task_id):
+    """删除任务及其相关的本地状态"""
+    task_store.delete(task_id)
+    forget_task(task_id)
+
+# 搜索结果缓存：相同参数的搜索在TTL内直接复用已完成的任务，进行中的任务则合并到同一个任务
+SEARCH_CACHE_TTL = 300
+search_index = {}  # 归一化的搜索参数 -> task_id
+search_index_lock = threading.Lock()
 
 # 平台支持
 SUPPORTED_PLATFORMS = ['bilibili', 'youtube']
+# 每个平台搜索返回、并参与合并匹配的最大视频数
+MERGE_MAX_PER_PLATFORM = 30
 
 # 请求头配置
 HEADERS = {
@@ -63,124 +400,662 @@ VIDEO_PAGE_HEADERS = {
 YOUTUBE_API_KEY = ""
 YOUTUBE_API_URL = "https://www.googleapis.com/youtube/v3/search"
 YOUTUBE_VIDEO_DETAIL_URL = "https://www.googleapis.com/youtube/v3/videos"
+YOUTUBE_SEARCH_PAGE_SIZE = 50  # search.list 每页结果数（API上限50）
+YOUTUBE_DETAIL_BATCH_SIZE = 50  # videos.list 每次请求的ID数（API上限50）
+YOUTUBE_SEARCH_CACHE_TTL = 3600  # 搜索结果页（视频ID列表）缓存时间（秒）
+
+# YouTube Data API 配额：每日额度在太平洋时间午夜重置
+YOUTUBE_DAILY_QUOTA = 10000
+YOUTUBE_QUOTA_COSTS = {'search.list': 100, 'videos.list': 1}
+YOUTUBE_QUOTA_DEGRADE_THRESHOLD = 2000  # 剩余额度低于此值时只搜索一页，并优先使用过期缓存
+YOUTUBE_QUOTA_STALE_TTL = 7 * 24 * 3600  # 配额不足时仍可使用的过期缓存（搜索结果页与视频详情）的保留时间（秒）
+YOUTUBE_QUOTA_DB_PATH = os.path.join(DATA_DIR, 'youtube_quota.db')
+YOUTUBE_QUOTA_RETENTION_DAYS = 7  # 配额流水保留天数
+
+# 本地缓存目录，可通过环境变量 VIDEO_RANK_CACHE_DIR 指定
+CACHE_DIR = os.environ.get('VIDEO_RANK_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
+
+# B站视频详情请求的最大并发数
+BILIBILI_DETAIL_CONCURRENCY = 8
+
+# HTTP连接池配置：按主机划分连接池，保持长连接复用TCP+TLS握手
+HTTP_TIMEOUT = 10  # 默认请求超时（秒），可为 (连接超时, 读取超时) 元组
+HTTP_POOL_CONNECTIONS = 16  # 每个适配器缓存的主机连接池数量
+HTTP_POOL_MAXSIZE = 10  # 默认每个主机连接池保留的最大连接数
+HTTP_HOST_POOL_MAXSIZE = {
+    'api.bilibili.com': 32,
+    'www.googleapis.com': 16,
+    'i.ytimg.com': 32,
+}
+
+# 运行指标：各阶段耗时直方图、上游错误计数，由 /metrics 以Prometheus文本格式输出（每个进程各自统计）
+STAGE_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class LatencyHistogram:
+    """按标签（阶段名）分组的累积直方图"""
+    
+    def __init__(self, buckets=STAGE_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._series = {}  # 阶段 -> [各桶计数, 总和, 次数]
+        self._lock = threading.Lock()
+    
+    def observe(self, stage, seconds):
+        with self._lock:
+            series = self._series.get(stage)
+            if series is None:
+                series = self._series[stage] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[0][i] += 1
+            series[1] += seconds
+            series[2] += 1
+    
+    def snapshot(self):
+        with self._lock:
+            return {stage: (list(counts), total, count) for stage, (counts, total, count) in self._series.items()}
+
+stage_latency = LatencyHistogram()
+upstream_errors = {}  # (主机, 状态) -> 次数
+_upstream_errors_lock = threading.Lock()
+
+def record_upstream_error(host, status):
+    """记录一次上游请求失败：status 为HTTP状态码，或 'timeout'/'error'"""
+    with _upstream_errors_lock:
+        key = (host or 'unknown', str(status))
+        upstream_errors[key] = upstream_errors.get(key, 0) + 1
+
+def upstream_error_status(exc):
+    """从异常中提取用于计数的状态"""
+    if isinstance(exc, (requests.Timeout, asyncio.TimeoutError, TimeoutError)):
+        return 'timeout'
+    response = getattr(exc, 'response', None)
+    status = getattr(exc, 'status', None) or getattr(response, 'status_code', None)
+    return status if isinstance(status, int) else 'error'
+
+class TaskTimings:
+    """单个任务各阶段的耗时汇总；并发执行的阶段（如多个详情请求）耗时累加"""
+    
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+    
+    def add(self, stage, seconds):
+        with self._lock:
+            item = self._stages.setdefault(stage, {'count': 0, 'total': 0.0, 'max': 0.0})
+            item['count'] += 1
+            item['total'] += seconds
+            item['max'] = max(item['max'], seconds)
+    
+    def snapshot(self):
+        with self._lock:
+            return {stage: {'count': item['count'], 'total': round(item['total'], 4), 'max': round(item['max'], 4)}
+                    for stage, item in self._stages.items()}
+
+# 当前任务的耗时汇总；线程池与共享事件循环中的代码通过 contextvars 继承
+current_task_timings = contextvars.ContextVar('current_task_timings', default=None)
+
+@contextmanager
+def timing_span(stage):
+    """计时一个阶段：写入耗时直方图，并累加到当前任务的 timings"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_latency.observe(stage, elapsed)
+        timings = current_task_timings.get()
+        if timings is not None:
+            timings.add(stage, elapsed)
+
+def submit_with_context(executor, func, *args):
+    """提交到线程池，并让任务继承当前的上下文变量（如当前任务的 timings）"""
+    return executor.submit(contextvars.copy_context().run, func, *args)
+
+# 按上游主机限流（令牌桶）：主机 -> (每秒请求数, 突发容量)，未列出的主机不限流
+RATE_LIMITS = {
+    'api.bilibili.com': (8, 16),
+    'search.bilibili.com': (2, 4),
+    'www.bilibili.com': (2, 4),
+    'www.googleapis.com': (10, 20),
+}
+
+class TokenBucket:
+    """进程内共享的令牌桶，同步与异步代码均可使用"""
+    
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def reserve(self):
+        """预约一个令牌，返回需要等待的秒数（令牌可透支，保证先到先得）"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0 if self._tokens >= 0 else -self._tokens / self.rate
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(host):
+    """获取主机对应的令牌桶，未配置限流的主机返回None"""
+    if host not in RATE_LIMITS:
+        return None
+    with _rate_limiters_lock:
+        if host not in _rate_limiters:
+            _rate_limiters[host] = TokenBucket(*RATE_LIMITS[host])
+        return _rate_limiters[host]
+
+def rate_limit(host):
+    """同步等待主机的请求配额"""
+    limiter = get_rate_limiter(host)
+    if limiter:
+        delay = limiter.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+async def rate_limit_async(host):
+    """异步等待主机的请求配额"""
+    limiter = get_rate_limiter(host)
+    if limiter:
+        delay = limiter.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    """获取全局共享的HTTP会话（按主机配置连接池大小）"""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            # 为高频主机挂载独立的适配器，使用单独配置的连接池大小
+            for host, maxsize in HTTP_HOST_POOL_MAXSIZE.items():
+                session.mount(f"https://{host}/", HTTPAdapter(pool_connections=1, pool_maxsize=maxsize))
+            _http_session = session
+        return _http_session
+
+def http_get(url, timeout=None, **kwargs):
+    """通过共享连接池发送GET请求（按主机限流，失败按主机与状态计数）"""
+    host = urlsplit(url).hostname
+    rate_limit(host)
+    try:
+        response = get_http_session().get(url, timeout=timeout or HTTP_TIMEOUT, **kwargs)
+    except Exception as e:
+        record_upstream_error(host, upstream_error_status(e))
+        raise
+    if response.status_code >= 400:
+        record_upstream_error(host, response.status_code)
+    return response
+
+def get_http_pool_stats():
+    """统计各主机连接池的命中（复用连接）与未命中（新建连接）次数"""
+    stats = {}
+    session = get_http_session()
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host_stats = stats.setdefault(pool.host, {'requests': 0, 'hits': 0, 'misses': 0})
+            host_stats['requests'] += pool.num_requests
+            host_stats['misses'] += pool.num_connections
+            host_stats['hits'] += max(pool.num_requests - pool.num_connections, 0)
+    return stats
+
+class TwoTierCache:
+    """两级缓存：内存LRU（有容量上限）+ 磁盘SQLite存储，支持TTL过期与淘汰
+    
+    stale_ttl > 0 时，过期条目在磁盘中再保留 stale_ttl 秒，读取时传 allow_stale=True 仍可命中。
+    """
+    
+    def __init__(self, name, max_items=1024, ttl=86400, max_disk_items=100000,
+                 dumps=json.dumps, loads=json.loads, directory=None, stale_ttl=0):
+        self.name = name
+        self.max_items = max_items
+        self.ttl = ttl
+        self.max_disk_items = max_disk_items
+        self.stale_ttl = stale_ttl
+        self._dumps = dumps
+        self._loads = loads
+        self._directory = directory or CACHE_DIR
+        self._memory = OrderedDict()  # key -> (value, expires_at)
+        self._memory_lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._db = None
+        self._writes = 0
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'stale_hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0}
+    
+    def _get_db(self):
+        # 首次使用时才创建数据库文件
+        if self._db is None:
+            os.makedirs(self._directory, exist_ok=True)
+            db = sqlite3.connect(os.path.join(self._directory, f"{self.name}.db"), check_same_thread=False)
+            db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires_at ON cache (expires_at)")
+            db.commit()
+            self._db = db
+        return self._db
+    
+    def _remember(self, key, value, expires_at):
+        with self._memory_lock:
+            self._memory[key] = (value, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_items:
+                self._memory.popitem(last=False)
+                self.stats['evictions'] += 1
+    
+    def _get_memory(self, key):
+        with self._memory_lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > time.time():
+                    self._memory.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    return entry[0]
+                del self._memory[key]
+                self.stats['expired'] += 1
+        return None
+    
+    def _get_disk(self, key, allow_stale=False):
+        try:
+            with self._disk_lock:
+                row = self._get_db().execute(
+                    "SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                value, expires_at = row
+                if expires_at > time.time():
+                    value = self._loads(value)
+                    self._remember(key, value, expires_at)
+                    self.stats['disk_hits'] += 1
+                    return value
+                if allow_stale and expires_at + self.stale_ttl > time.time():
+                    self.stats['stale_hits'] += 1
+                    return self._loads(value)
+                self.stats['expired'] += 1
+        except Exception as e:
+            logger.warning("读取磁盘缓存 %s 失败: %s", self.name, e)
+        
+        self.stats['misses'] += 1
+        return None
+    
+    def get(self, key):
+        """读取缓存，未命中或已过期返回None"""
+        value = self._get_memory(key)
+        if value is None:
+            value = self._get_disk(key)
+        return value
+    
+    async def get_many_async(self, keys, allow_stale=False):
+        """在事件循环中批量读取缓存，返回命中的 {键: 值}；内存未命中的键在线程池中读取磁盘
+        
+        allow_stale 为True时，过期不超过 stale_ttl 的磁盘条目也算命中。
+        """
+        found = {}
+        for key in keys:
+            value = self._get_memory(key)
+            if value is not None:
+                found[key] = value
+        missing = [key for key in keys if key not in found]
+        if missing:
+            values = await asyncio.to_thread(lambda: [self._get_disk(key, allow_stale) for key in missing])
+            found.update((key, value) for key, value in zip(missing, values) if value is not None)
+        return found
+    
+    async def get_async(self, key, allow_stale=False):
+        """get 的异步版本，磁盘读取不阻塞事件循环"""
+        return (await self.get_many_async([key], allow_stale)).get(key)
+    
+    def _write_disk(self, rows):
+        try:
+            with self._disk_lock:
+                db = self._get_db()
+                db.executemany("INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                               [(key, self._dumps(value), expires_at) for key, value, expires_at in rows])
+                db.commit()
+                writes, self._writes = self._writes, self._writes + len(rows)
+                # 定期清理过期条目，并在超出容量时淘汰最早过期的条目
+                if writes // 256 != self._writes // 256:
+                    self._prune(db)
+        except Exception as e:
+            logger.warning("写入磁盘缓存 %s 失败: %s", self.name, e)
+    
+    def _set_memory(self, items, ttl):
+        expires_at = time.time() + (ttl or self.ttl)
+        rows = []
+        for key, value in items.items():
+            self._remember(key, value, expires_at)
+            rows.append((key, value, expires_at))
+        return rows
+    
+    def set(self, key, value, ttl=None):
+        """写入缓存（内存与磁盘）"""
+        self._write_disk(self._set_memory({key: value}, ttl))
+    
+    async def set_many_async(self, items, ttl=None):
+        """在事件循环中批量写入 {键: 值}：立即写入内存，磁盘写入在线程池中以一个事务完成"""
+        if items:
+            await asyncio.to_thread(self._write_disk, self._set_memory(items, ttl))
+    
+    async def set_async(self, key, value, ttl=None):
+        """set 的异步版本，磁盘写入不阻塞事件循环"""
+        await self.set_many_async({key: value}, ttl)
+    
+    def _prune(self, db):
+        db.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time() - self.stale_ttl,))
+        count = db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        if count > self.max_disk_items:
+            db.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires_at LIMIT ?)",
+                (count - self.max_disk_items,))
+            self.stats['evictions'] += count - self.max_disk_items
+        db.commit()
+    
+    def get_stats(self):
+        with self._memory_lock:
+            size = len(self._memory)
+        return dict(self.stats, memory_items=size, max_items=self.max_items, ttl=self.ttl)
+
+def bilibili_api_headers(bv_id):
+    """B站视频API请求头"""
+    return {
+        'User-Agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/140.0.0.0 Safari/537.36",
+        'Referer': f"https://www.bilibili.com/video/{bv_id}/"
+    }
+
+# 共享异步运行时：后台线程中常驻一个事件循环，所有B站协程都提交到该循环执行，
+# 从而复用同一个客户端会话与连接池
+_async_loop = None
+_async_loop_lock = threading.Lock()
+
+def get_async_loop():
+    """获取（必要时启动）共享的后台事件循环"""
+    global _async_loop
+    with _async_loop_lock:
+        if _async_loop is None:
+            loop = asyncio.new_event_loop()
+            
+            def run_loop():
+                asyncio.set_event_loop(loop)
+                # 设置请求客户端为aiohttp
+                try:
+                    select_client("aiohttp")
+                except Exception:
+                    logger.warning("aiohttp不可用，将使用默认客户端")
+                loop.run_forever()
+            
+            loop_thread = threading.Thread(target=run_loop, name='async-runtime')
+            loop_thread.daemon = True
+            loop_thread.start()
+            _async_loop = loop
+        return _async_loop
+
+async def _run_in_context(coro, context):
+    # 协程在事件循环线程中执行，需要显式带上调用线程的上下文变量（当前任务ID与耗时汇总）
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+def run_async(coro, timeout=None):
+    """在共享事件循环中执行协程，并在调用线程中同步等待结果"""
+    future = asyncio.run_coroutine_threadsafe(_run_in_context(coro, contextvars.copy_context()), get_async_loop())
+    try:
+        return future.result(timeout)
+    except Exception:
+        future.cancel()
+        raise
+
+# 共享事件循环上的aiohttp会话（仅在事件循环线程内创建和使用）
+_aiohttp_session = None
+
+def get_aiohttp_session():
+    """获取共享的aiohttp会话，必须在共享事件循环中调用"""
+    global _aiohttp_session
+    if _aiohttp_session is None or _aiohttp_session.closed:
+        if isinstance(HTTP_TIMEOUT, tuple):
+            timeout = aiohttp.ClientTimeout(sock_connect=HTTP_TIMEOUT[0], sock_read=HTTP_TIMEOUT[1])
+        else:
+            timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT)
+        connector = aiohttp.TCPConnector(limit_per_host=max([HTTP_POOL_MAXSIZE, *HTTP_HOST_POOL_MAXSIZE.values()]))
+        _aiohttp_session = aiohttp.ClientSession(timeout=timeout, connector=connector)
+    return _aiohttp_session
+
+async def http_get_json_async(url, params=None, headers=None):
+    """异步GET请求并解析JSON（按主机限流，复用共享会话，失败按主机与状态计数）"""
+    host = urlsplit(url).hostname
+    await rate_limit_async(host)
+    try:
+        async with get_aiohttp_session().get(url, params=params, headers=headers) as response:
+            response.raise_for_status()
+            return await response.json()
+    except Exception as e:
+        record_upstream_error(host, upstream_error_status(e))
+        raise
+
+# 视频元数据缓存：按 (平台, 视频ID) 保存标题、播放量、作者与缩略图URL，
+# 在有效期内重复搜索只需获取未缓存的视频
+VIDEO_METADATA_TTL = 3600
+video_metadata_cache = TwoTierCache('video_metadata', max_items=10000, ttl=VIDEO_METADATA_TTL,
+                                    stale_ttl=YOUTUBE_QUOTA_STALE_TTL)
+
+def get_video_metadata(platform, video_id):
+    """读取缓存的视频元数据，未命中返回None"""
+    return video_metadata_cache.get(f"{platform}:{video_id}")
+
+def cache_video_metadata(platform, video_id, title='', view_count=0, author='', thumbnail_url=''):
+    """写入视频元数据缓存并返回该元数据"""
+    metadata = {
+        'title': title,
+        'view_count': view_count,
+        'author': author,
+        'thumbnail_url': thumbnail_url
+    }
+    video_metadata_cache.set(f"{platform}:{video_id}", metadata)
+    return metadata
+
+# 事件循环中的协程使用以下异步版本，SQLite读写在线程池中执行
+async def get_video_metadata_async(platform, video_id):
+    return await video_metadata_cache.get_async(f"{platform}:{video_id}")
+
+async def cache_video_metadata_async(platform, video_id, metadata):
+    await video_metadata_cache.set_async(f"{platform}:{video_id}", metadata)
+    return metadata
+
+def bilibili_info_metadata(info):
+    """从B站视频详情（bilibili-api或view接口的data字段）提取元数据"""
+    return {
+        'title': info.get('title', ''),
+        'view_count': info.get('stat', {}).get('view', 0),
+        'author': info.get('owner', {}).get('name', ''),
+        'thumbnail_url': info.get('pic', '')
+    }
+
+def cache_bilibili_info(bv_id, info):
+    """从B站视频详情写入元数据缓存"""
+    return cache_video_metadata('bilibili', bv_id, **bilibili_info_metadata(info))
 
 # 异步获取B站视频详情
 async def get_video_info_async(bv_id):
+    cached = await get_video_metadata_async('bilibili', bv_id)
+    if cached is not None:
+        return cached['view_count'], cached['title']
     try:
         v = video.Video(bvid=bv_id)
-        info = await v.get_info()
-        stat = info.get('stat', {})
-        view_count = stat.get('view', 0)
-        title = info.get('title', '')
-        return view_count, title
+        await rate_limit_async('api.bilibili.com')
+        with timing_span('bilibili_video_info'):
+            info = await v.get_info()
+        metadata = await cache_video_metadata_async('bilibili', bv_id, bilibili_info_metadata(info))
+        return metadata['view_count'], metadata['title']
     except Exception as e:
-        print(f"获取视频详情异步失败 {bv_id}: {e}")
+        record_upstream_error('api.bilibili.com', upstream_error_status(e))
+        logger.warning("获取视频详情异步失败 %s: %s", bv_id, e)
         return 0, ""
 
+async def get_bilibili_view_async(bv_id):
+    """通过一次 view 接口请求获取标题、播放量、作者与封面，失败返回None"""
+    cached = await get_video_metadata_async('bilibili', bv_id)
+    if cached is not None:
+        return cached
+    try:
+        with timing_span('bilibili_video_info'):
+            data = await http_get_json_async(
+                "https://api.bilibili.com/x/web-interface/view",
+                params={'bvid': bv_id},
+                headers=bilibili_api_headers(bv_id)
+            )
+        if data.get('code') == 0 and data.get('data'):
+            return await cache_video_metadata_async('bilibili', bv_id, bilibili_info_metadata(data['data']))
+        logger.warning("view接口返回错误 %s: %s", bv_id, data.get('code'))
+    except Exception as e:
+        logger.warning("view接口获取 %s 失败: %s", bv_id, e)
+    return None
+
+async def get_bilibili_views_async(bv_ids, concurrency=None):
+    """并发获取多个视频的 view 接口数据，结果与 bv_ids 顺序一致"""
+    semaphore = asyncio.Semaphore(concurrency or BILIBILI_DETAIL_CONCURRENCY)
+    
+    async def fetch(bv_id):
+        async with semaphore:
+            return await get_bilibili_view_async(bv_id)
+    
+    return await asyncio.gather(*(fetch(bv_id) for bv_id in bv_ids))
+
 # 异步搜索B站视频
-async def search_bilibili_async(keyword, max_results=30):
-    print(f"开始异步搜索B站: {keyword}")
+async def search_bilibili_async(keyword, max_results=None, concurrency=None):
+    logger.info("开始异步搜索B站: %s", keyword)
+    max_results = max_results or MERGE_MAX_PER_PLATFORM
     items = []
     processed_bvs = set()
     page_size = 30  # 每页返回的结果数量
     max_pages = 3  # 最多搜索3页
+    # 详情请求并发上限（请求频率由按主机的令牌桶限制）
+    semaphore = asyncio.Semaphore(concurrency or BILIBILI_DETAIL_CONCURRENCY)
     
-    # 设置请求客户端为aiohttp
-    try:
-        select_client("aiohttp")
-    except Exception:
-        print("aiohttp不可用，将使用默认客户端")
+    async def fetch_page(page):
+        logger.debug("搜索B站第 %s 页", page)
+        # 使用bilibili-api-python的search_by_type函数，按播放量排序
+        await rate_limit_async('api.bilibili.com')
+        try:
+            with timing_span('bilibili_search_page'):
+                return await search_by_type(
+                    keyword=keyword,
+                    search_type=SearchObjectType.VIDEO,
+                    order_type=OrderVideo.CLICK,  # 按最多点击排序
+                    page=page,
+                    page_size=page_size
+                )
+        except Exception as e:
+            record_upstream_error('api.bilibili.com', upstream_error_status(e))
+            raise
+    
+    async def build_item(item, bv_id):
+        # 获取视频详情（受并发上限约束）
+        async with semaphore:
+            view_count, title = await get_video_info_async(bv_id)
+        
+        # 如果异步获取失败，使用搜索结果中的数据
+        if not title:
+            title = re.sub(r'<[^>]+>', '', item.get('title', f"B站视频 {bv_id}"))
+        if view_count == 0:
+            view_count = int(item.get('play', 0))
+        
+        link = f"https://www.bilibili.com/video/{bv_id}/"
+        
+        # 优先尝试从搜索结果获取封面pic
+        pic = item.get('pic')
+        thumbnail_url = "https:" + pic if pic and pic.startswith('//') else pic
+        
+        # 若未获得pic，尝试通过视频页按标题匹配提取封面
+        if not thumbnail_url:
+            try:
+                thumbnail_url = get_bilibili_thumbnail_from_page(link, title)
+            except Exception as e:
+                logger.warning("从页面获取缩略图失败: %s", e)
+        
+        # 最后回退占位图，保证UI稳定
+        if not thumbnail_url:
+            thumbnail_url = f"https://picsum.photos/seed/{bv_id}/320/180"
+        
+        log_item("添加视频: %s..., 播放量: %s", title[:30], view_count)
+        return {
+            'title': title,
+            'url': link,
+            'bv_id': bv_id,
+            'view_count': view_count,
+            'platform': 'bilibili',
+            'thumbnail_url': thumbnail_url
+        }
     
-    # 搜索视频，按播放量排序
+    # 第N页的详情解析期间，第N+1页的搜索请求已在进行
+    next_page = asyncio.ensure_future(fetch_page(1))
     for page in range(1, max_pages + 1):
-        print(f"搜索B站第 {page} 页")
+        page_task, next_page = next_page, None
         try:
-            # 使用bilibili-api-python的search_by_type函数
-            search_result = await search_by_type(
-                keyword=keyword,
-                search_type=SearchObjectType.VIDEO,
-                order_type=OrderVideo.CLICK,  # 按最多点击排序
-                page=page,
-                page_size=page_size
-            )
+            search_result = await page_task
+            results = search_result.get('result') or []
             
-            # 处理搜索结果
-            if 'result' in search_result and search_result['result']:
-                for item in search_result['result']:
-                    if len(items) >= max_results:
-                        break
-                    
-                    bv_id = item.get('bvid')
-                    if not bv_id or bv_id in processed_bvs:
-                        continue
-                    
-                    processed_bvs.add(bv_id)
-                    
-                    # 获取视频详情
-                    view_count, title = await get_video_info_async(bv_id)
-                    
-                    # 如果异步获取失败，使用搜索结果中的数据
-                    if not title:
-                        title = re.sub(r'<[^>]+>', '', item.get('title', f"B站视频 {bv_id}"))
-                    if view_count == 0:
-                        view_count = int(item.get('play', 0))
-                    
-                    link = f"https://www.bilibili.com/video/{bv_id}/"
-                    
-                    # 优先尝试从搜索结果获取封面pic
-                    thumbnail_url = "https:"+item.get('pic')
-                    
-                    # 若未获得pic，尝试通过视频页按标题匹配提取封面
-                    if not thumbnail_url:
-                        try:
-                            thumbnail_url = get_bilibili_thumbnail_from_page(link, title)
-                        except Exception as e:
-                            print(f"从页面获取缩略图失败: {e}")
-                    
-                    # 最后回退占位图，保证UI稳定
-                    if not thumbnail_url:
-                        thumbnail_url = f"https://picsum.photos/seed/{bv_id}/320/180"
-                    
-                    items.append({
-                        'title': title,
-                        'url': link,
-                        'bv_id': bv_id,
-                        'view_count': view_count,
-                        'platform': 'bilibili',
-                        'thumbnail_url': thumbnail_url
-                    })
-                    
-                    print(f"添加视频: {title[:30]}..., 播放量: {view_count}")
-                    
-                    # 限制请求频率，避免触发反爬
-                    await asyncio.sleep(0.1)
+            # 结果不足一页说明没有更多结果，否则预取下一页
+            if page < max_pages and len(results) >= page_size:
+                next_page = asyncio.ensure_future(fetch_page(page + 1))
             
-            # 如果没有更多结果，退出循环
-            if len(search_result.get('result', [])) < page_size:
-                break
+            # 按搜索结果顺序挑选本页需要获取详情的视频（去重）
+            selected = []
+            for item in results:
+                if len(items) + len(selected) >= max_results:
+                    break
+                
+                bv_id = item.get('bvid')
+                if not bv_id or bv_id in processed_bvs:
+                    continue
+                
+                processed_bvs.add(bv_id)
+                selected.append((item, bv_id))
+            
+            # 并发获取本页详情，gather保持结果顺序与搜索结果一致
+            page_items = await asyncio.gather(*(build_item(item, bv_id) for item, bv_id in selected))
+            items.extend(page_items)
                 
         except Exception as e:
-            print(f"搜索第 {page} 页失败: {e}")
+            logger.warning("搜索第 %s 页失败: %s", page, e)
             # 继续尝试下一页
+            if next_page is None and page < max_pages:
+                next_page = asyncio.ensure_future(fetch_page(page + 1))
             continue
+        
+        # 已获取足够的视频或没有更多结果，退出循环
+        if next_page is None or len(items) >= max_results:
+            break
+    
+    # 取消不再需要的预取请求
+    if next_page is not None and not next_page.done():
+        next_page.cancel()
     
-    print(f"异步搜索B站完成，获取到 {len(items)} 个视频")
+    logger.info("异步搜索B站完成，获取到 %s 个视频", len(items))
     return items
 
 # 搜索哔哩哔哩
-import random
 
 def search_bilibili(keyword, task_id=None, task_queue=None):
     try:
         # 保留原始关键词
-        print(f"开始搜索B站: {keyword}")
+        logger.info("开始搜索B站: %s", keyword)
         items = []
         
         # 初始化进度更新函数
         def update_progress(progress):
             if task_id and task_queue:
                 task_queue.put((task_id, 'bilibili_progress', progress))
-                print(f"更新B站搜索进度: {progress}%")
+                log_item("更新B站搜索进度: %s%%", progress)
         
         # 初始进度
         update_progress(0)
@@ -194,6 +1069,7 @@ def search_bilibili(keyword, task_id=None, task_queue=None):
                     update_progress(page_progress)
                     
                     # 搜索视频内容
+                    await rate_limit_async('api.bilibili.com')
                     result = await search_by_type(
                         keyword=keyword,
                         search_type=SearchObjectType.VIDEO,
@@ -220,12 +1096,9 @@ def search_bilibili(keyword, task_id=None, task_queue=None):
                                     'author': item.get('author', '') or details.get('owner', {}).get('name', ''),
                                     'thumbnail_url': thumbnail_url
                                 })
-                    
-                    # 避免请求过快
-                    await asyncio.sleep(1)
                 
             except Exception as e:
-                print(f"B站搜索错误: {e}")
+                logger.warning("B站搜索错误: %s", e)
                 # 添加模拟数据用于测试
                 if not items:
                     items.extend([
@@ -243,23 +1116,21 @@ def search_bilibili(keyword, task_id=None, task_queue=None):
         async def async_get_video_details(bv_id):
             try:
                 v = video.Video(bvid=bv_id)
+                await rate_limit_async('api.bilibili.com')
                 info = await v.get_info()
                 # 添加缩略图URL（封面图）
                 if info.get('pic'):
                     info['thumbnail_url'] = info['pic']
                 return info
             except Exception as e:
-                print(f"获取B站视频详情失败: {e}")
+                logger.warning("获取B站视频详情失败: %s", e)
                 return {
                     'owner': {'name': f"B站UP主"},
                     'thumbnail_url': f"https://picsum.photos/seed/{bv_id}/320/180"
                 }
         
-        # 运行异步函数
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(async_search_bilibili())
-        loop.close()
+        # 在共享事件循环中运行异步函数
+        run_async(async_search_bilibili())
         
         # 如果还是没有数据，添加一些模拟数据用于测试
         if not items:
@@ -294,12 +1165,12 @@ def search_bilibili(keyword, task_id=None, task_queue=None):
             ]
         
         update_progress(90)  # 搜索完成，进度90%
-        print(f"B站搜索完成，获取到 {len(items)} 个视频")
+        logger.info("B站搜索完成，获取到 %s 个视频", len(items))
         # 按播放量降序排序
         items.sort(key=lambda x: x.get('view_count', 0), reverse=True)
-        return items[:30]  # 确保最多返回30个视频
+        return items[:MERGE_MAX_PER_PLATFORM]  # 确保每个平台最多返回 MERGE_MAX_PER_PLATFORM 个视频
     except Exception as e:
-        print(f"B站搜索失败: {str(e)}")
+        logger.error("B站搜索失败: %s", e)
         # 添加一些模拟数据作为最后的备用
         mock_data = [
             {
@@ -323,7 +1194,7 @@ def search_bilibili(keyword, task_id=None, task_queue=None):
 
 # 备用搜索方案（原有的网页抓取方式）
 def fallback_search_bilibili(encoded_keyword, task_id=None, task_queue=None):
-    print("使用备用搜索方案")
+    logger.info("使用备用搜索方案")
     items = []
     processed_bvs = set()
     
@@ -331,7 +1202,7 @@ def fallback_search_bilibili(encoded_keyword, task_id=None, task_queue=None):
     def update_progress(progress):
         if task_id and task_queue:
             task_queue.put((task_id, 'bilibili_progress', progress))
-            print(f"更新B站搜索进度: {progress}%")
+            log_item("更新B站搜索进度: %s%%", progress)
     
     # 初始进度
     update_progress(0)
@@ -343,83 +1214,75 @@ def fallback_search_bilibili(encoded_keyword, task_id=None, task_queue=None):
     
     for page in range(1, total_pages + 1):  # 爬取前3页
         url = f"https://search.bilibili.com/video?keyword={encoded_keyword}&order=click&page={page}"
-        print(f"搜索URL: {url} (第{page}页)")
+        logger.debug("搜索URL: %s (第%s页)", url, page)
         
         # 页面加载进度
         page_progress = (page - 1) * page_weight / total_pages
         update_progress(int(page_progress))
         
         try:
-            response = requests.get(url, headers=HEADERS, timeout=10)
+            response = http_get(url, headers=HEADERS)
             response.raise_for_status()
             
             # 尝试同时提取BV号和标题
-            print(f"尝试从第{page}页提取BV号和标题...")
+            logger.debug("尝试从第%s页提取BV号和标题...", page)
             # 使用更精确的正则表达式匹配视频条目和标题
             video_pattern = r'<a[^>]*href="/video/(BV[0-9A-Za-z]{10})/"[^>]*title="([^"]+)"'
             video_matches = re.findall(video_pattern, response.text)
             
-            # 处理带标题的匹配结果
-            total_videos_this_page = len(video_matches[:20])
-            for idx, (bv_id, title) in enumerate(video_matches[:20]):  # 每页最多处理前20个匹配
-                if bv_id in processed_bvs or len(items) >= 30:
+            # 按搜索结果顺序挑选本页需要获取详情的视频（去重，每页最多处理前20个匹配）
+            selected = []
+            for bv_id, title in video_matches[:20]:
+                if len(items) + len(selected) >= MERGE_MAX_PER_PLATFORM:
+                    break
+                if bv_id in processed_bvs:
                     continue
                 processed_bvs.add(bv_id)
-                
+                selected.append((bv_id, title))
+            
+            # 每个视频只请求一次 view 接口（标题、播放量、封面），本页的请求并发执行
+            views = run_async(get_bilibili_views_async([bv_id for bv_id, _ in selected]))
+            
+            for idx, ((bv_id, title), view) in enumerate(zip(selected, views)):
                 try:
-                    # 获取视频统计信息和详细标题
-                    view_count, detailed_title = get_bilibili_video_details(bv_id)
+                    if view is not None:
+                        view_count, detailed_title = view['view_count'], view['title']
+                        thumbnail_url = view['thumbnail_url']
+                    else:
+                        # view 接口失败时才使用较慢的备用方式（bilibili-api、页面解析），不再重复请求 view 接口
+                        view_count, detailed_title = get_bilibili_video_details(bv_id, view_api=False)
+                        thumbnail_url = ''
                     
                     # 优先使用从详情API获取的标题，如果没有则使用搜索结果中的标题
                     final_title = detailed_title if detailed_title and detailed_title.strip() else re.sub(r'<[^>]+>', '', title)
                     link = f"https://www.bilibili.com/video/{bv_id}/"
                     
-                    # 获取B站视频缩略图URL
-                    thumbnail_url = f"https://picsum.photos/seed/{bv_id}/320/180"
-                    try:
-                        # 尝试从API获取真实缩略图URL
-                        api_url = f"https://api.bilibili.com/x/web-interface/view?bvid={bv_id}"
-                        api_response = requests.get(api_url, headers=api_headers, timeout=3)
-                        api_data = api_response.json()
-                        if api_data.get('code') == 0 and 'data' in api_data and 'pic' in api_data['data']:
-                            thumbnail_url = api_data['data']['pic']
-                            print(f"获取B站视频 {bv_id} 缩略图成功")
-                    except Exception as e:
-                        print(f"获取B站缩略图失败: {e}")
-                    
                     items.append({
                             'title': final_title,
                             'url': link,
                             'bv_id': bv_id,
                             'view_count': view_count,
                             'platform': 'bilibili',
-                            'thumbnail_url': thumbnail_url
+                            'thumbnail_url': thumbnail_url or f"https://picsum.photos/seed/{bv_id}/320/180"
                         })
                     
-                    print(f"添加视频: {final_title[:30]}..., 播放量: {view_count}")
+                    log_item("添加视频: %s..., 播放量: %s", final_title[:30], view_count)
                     
                     # 计算并更新进度
                     current_progress = page_progress + (idx + 1) * video_weight / (total_pages * 40)  # 假设每页最多40个视频
                     update_progress(min(int(current_progress), 90))  # 保留10%给API调用部分
-                    
-                    # 限制请求频率
-                    time.sleep(0.3)
-                    
-                    # 达到目标数量
-                    if len(items) >= 30:
-                        break
                         
                 except Exception as e:
-                    print(f"处理视频 {bv_id} 失败: {e}")
+                    logger.warning("处理视频 %s 失败: %s", bv_id, e)
                     continue
         
         except Exception as e:
-            print(f"处理第{page}页失败: {e}")
+            logger.warning("处理第%s页失败: %s", page, e)
             continue
         
         # 如果已经获取到足够的视频，提前退出循环
-        if len(items) >= 30:
-            print(f"已获取到 {len(items)} 个视频，提前退出循环")
+        if len(items) >= MERGE_MAX_PER_PLATFORM:
+            logger.debug("已获取到 %s 个视频，提前退出循环", len(items))
             update_progress(90)  # 标记B站爬取完成
             break
     
@@ -429,50 +1292,48 @@ def fallback_search_bilibili(encoded_keyword, task_id=None, task_queue=None):
 def search_bilibili(keyword, task_id=None, task_queue=None):
     try:
         # 保留原始关键词
-        print(f"开始搜索B站: {keyword}")
+        logger.info("开始搜索B站: %s", keyword)
         items = []
         
         # 初始化进度更新函数
         def update_progress(progress):
             if task_id and task_queue:
                 task_queue.put((task_id, 'bilibili_progress', progress))
-                print(f"更新B站搜索进度: {progress}%")
+                log_item("更新B站搜索进度: %s%%", progress)
         
         # 初始进度
         update_progress(0)
         
         # 运行异步搜索
         try:
-            # 创建事件循环并运行异步函数
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
             # 分批次获取视频，每获取一批更新一次进度
             batch_size = 10
-            all_items = loop.run_until_complete(search_bilibili_async(keyword, 60))  # 获取更多结果用于选择
+            # 在共享事件循环中运行异步搜索
+            limit = MERGE_MAX_PER_PLATFORM
+            all_items = run_async(search_bilibili_async(keyword, limit * 2))  # 获取更多结果用于选择
             
             # 按播放量排序
             all_items.sort(key=lambda x: x['view_count'], reverse=True)
             
-            # 选择前30个结果并更新进度
-            for i in range(0, min(30, len(all_items)), batch_size):
-                batch_end = min(i + batch_size, 30)
+            # 选择前 limit 个结果并更新进度
+            for i in range(0, min(limit, len(all_items)), batch_size):
+                batch_end = min(i + batch_size, limit)
                 items.extend(all_items[i:batch_end])
-                progress = int((batch_end / 30) * 80)  # 80%的进度用于获取视频
+                progress = int((batch_end / limit) * 80)  # 80%的进度用于获取视频
                 update_progress(progress)
-                print(f"处理批次 {i//batch_size + 1}/{(30+batch_size-1)//batch_size}")
+                logger.debug("处理批次 %s/%s", i // batch_size + 1, (limit + batch_size - 1) // batch_size)
                 
         except Exception as e:
-            print(f"异步搜索失败: {e}")
+            logger.warning("异步搜索失败: %s", e)
             # 降级到备用方案
-            print("尝试使用备用搜索方案...")
+            logger.info("尝试使用备用搜索方案...")
             import urllib.parse
             encoded_keyword = urllib.parse.quote(keyword)
             items = fallback_search_bilibili(encoded_keyword, task_id, task_queue)
         
         # 如果使用备用方案后仍然没有数据，添加一些模拟数据用于测试
         if not items:
-            print("添加模拟数据用于测试...")
+            logger.warning("添加模拟数据用于测试...")
             mock_data = [
                 {
                     'title': 'Python入门教程 - 零基础到精通',
@@ -499,12 +1360,12 @@ def search_bilibili(keyword, task_id=None, task_queue=None):
             items.extend(mock_data)
         
         update_progress(90)  # 搜索完成，进度90%
-        print(f"B站搜索完成，获取到 {len(items)} 个视频")
+        logger.info("B站搜索完成，获取到 %s 个视频", len(items))
         # 按播放量降序排序
         items.sort(key=lambda x: x['view_count'], reverse=True)
-        return items[:30]  # 确保最多返回50个视频
+        return items[:MERGE_MAX_PER_PLATFORM]  # 确保每个平台最多返回 MERGE_MAX_PER_PLATFORM 个视频
     except Exception as e:
-        print(f"B站搜索失败: {str(e)}")
+        logger.error("B站搜索失败: %s", e)
         # 添加一些模拟数据作为最后的备用
         mock_data = [
             {
@@ -524,255 +1385,515 @@ def search_bilibili(keyword, task_id=None, task_queue=None):
         ]
         return mock_data
 
-def get_bilibili_video_details(bv_id):
-    """获取B站视频的播放量和标题"""
+def get_bilibili_video_details(bv_id, view_api=True):
+    """获取B站视频的播放量和标题
+    
+    view_api 为False时（调用方的 view 接口请求已失败）跳过 view 接口，依次使用bilibili-api与页面解析。
+    """
+    cached = get_video_metadata('bilibili', bv_id)
+    if cached is not None:
+        return cached['view_count'], cached['title']
     try:
         # 优先使用bilibili-api-python
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            view_count, title = loop.run_until_complete(get_video_info_async(bv_id))
+            view_count, title = run_async(get_video_info_async(bv_id))
             if view_count > 0 or title:
-                print(f"成功从bilibili-api获取 {bv_id} 标题: {title}, 播放量: {view_count}")
+                log_item("成功从bilibili-api获取 %s 标题: %s, 播放量: %s", bv_id, title, view_count)
                 return view_count, title
         except Exception as api_error:
-            print(f"bilibili-api获取详情失败: {api_error}")
+            logger.warning("bilibili-api获取详情失败: %s", api_error)
         
         # 备用：使用B站视频页面API
-        api_url = f"https://api.bilibili.com/x/web-interface/view?bvid={bv_id}"
-        api_headers = {
-            'User-Agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/140.0.0.0 Safari/537.36",
-            'Referer': f"https://www.bilibili.com/video/{bv_id}/"
-        }
-        
-        print(f"尝试从API获取 {bv_id} 详情...")
-        response = requests.get(api_url, headers=api_headers, timeout=5)
-        data = response.json()
-        
-        if data.get('code') == 0:
-            view_count = data['data']['stat'].get('view', 0)
-            title = data['data'].get('title', '')
-            print(f"成功从API获取 {bv_id} 标题: {title}, 播放量: {view_count}")
-            return view_count, title
+        if view_api:
+            api_url = f"https://api.bilibili.com/x/web-interface/view?bvid={bv_id}"
+            
+            log_item("尝试从API获取 %s 详情...", bv_id)
+            response = http_get(api_url, headers=bilibili_api_headers(bv_id), timeout=5)
+            data = response.json()
+            
+            if data.get('code') == 0:
+                metadata = cache_bilibili_info(bv_id, data['data'])
+                view_count, title = metadata['view_count'], metadata['title']
+                log_item("成功从API获取 %s 标题: %s, 播放量: %s", bv_id, title, view_count)
+                return view_count, title
     
     except Exception as e:
-        print(f"API获取 {bv_id} 详情失败: {e}")
+        logger.warning("API获取 %s 详情失败: %s", bv_id, e)
     
-    # 后备方法：获取播放量
-    view_count = get_bilibili_video_stats(bv_id)
-    return view_count, ""
+    # 后备方法：从视频页解析播放量（view 接口已请求过，不再重复）
+    return scrape_bilibili_view_count(bv_id), ""
 
 # 获取B站视频详细数据
 def get_bilibili_video_stats(bv_id):
+    cached = get_video_metadata('bilibili', bv_id)
+    if cached is not None:
+        return cached['view_count']
     try:
-        print(f"获取视频 {bv_id} 的播放量数据")
+        log_item("获取视频 %s 的播放量数据", bv_id)
         # 使用B站API获取视频信息，这比爬取HTML更稳定
         api_url = f"https://api.bilibili.com/x/web-interface/view?bvid={bv_id}"
-        api_headers = {
-            'User-Agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/140.0.0.0 Safari/537.36",
-            'Referer': f"https://www.bilibili.com/video/{bv_id}/"
-        }
         
         # 发送API请求
-        response = requests.get(api_url, headers=api_headers, timeout=10)
+        response = http_get(api_url, headers=bilibili_api_headers(bv_id))
         response.raise_for_status()
         
         # 解析JSON响应
         data = response.json()
         if data.get('code') == 0 and 'data' in data and 'stat' in data['data']:
-            play_count = data['data']['stat'].get('view', 0)
-            print(f"成功从API获取 {bv_id} 播放量: {play_count}")
+            play_count = cache_bilibili_info(bv_id, data['data'])['view_count']
+            log_item("成功从API获取 %s 播放量: %s", bv_id, play_count)
             return play_count
     except Exception as e:
-        print(f"获取视频统计信息API失败: {e}")
+        logger.warning("获取视频统计信息API失败: %s", e)
     
     # 备用方法：爬取HTML页面
+    return scrape_bilibili_view_count(bv_id)
+
+def scrape_bilibili_view_count(bv_id):
+    """从视频页HTML解析播放量，失败返回0"""
     try:
         url = f"https://www.bilibili.com/video/{bv_id}/"
-        response = requests.get(url, headers=VIDEO_PAGE_HEADERS, timeout=10)
-        response.raise_for_status()
-        
-        # 方法1：从页面中提取stat数据
-        stat_match = re.search(r'window\.__INITIAL_STATE__\s*=\s*(.*?);\s*\(function\(', response.text)
-        if stat_match:
-            try:
-                initial_data = json.loads(stat_match.group(1))
-                # 尝试不同的数据路径
-                if 'videoData' in initial_data and 'stat' in initial_data['videoData']:
-                    view_count = initial_data['videoData']['stat'].get('view', 0)
-                    print(f"从INITIAL_STATE获取播放量: {view_count}")
-                    return view_count
-                elif 'videoData' in initial_data:
-                    view_count = initial_data['videoData'].get('stat', {}).get('view', 0)
-                    print(f"从videoData获取播放量: {view_count}")
-                    return view_count
-                elif 'data' in initial_data and 'stat' in initial_data['data']:
-                    view_count = initial_data['data']['stat'].get('view', 0)
-                    print(f"从data.stat获取播放量: {view_count}")
-                    return view_count
-            except Exception as json_error:
-                print(f"解析JSON失败: {json_error}")
-        
-        # 方法2：使用多种正则表达式提取播放量
-        view_patterns = [
-            r'"view"\s*:\s*(\d+)',
-            r'view="(\d+)"',
-            r'观看\s*<[^>]*>\s*(\d+)',
-            r'播放\s*<[^>]*>\s*(\d+)',
-            r'play\s*:\s*(\d+)'  
-        ]
-        
-        for pattern in view_patterns:
-            view_match = re.search(pattern, response.text)
-            if view_match:
-                view_count = int(view_match.group(1))
-                print(f"从正则 {pattern} 获取播放量: {view_count}")
+        if BILIBILI_PAGE_STREAMING:
+            # 分块读取，解析到 videoData.stat.view 即停止并关闭连接
+            with http_get(url, headers=VIDEO_PAGE_HEADERS, stream=True) as response:
+                response.raise_for_status()
+                view_count, text = stream_view_count(response)
+            if view_count is not None:
+                log_item("从页面流式解析获取播放量: %s", view_count)
                 return view_count
+        else:
+            response = http_get(url, headers=VIDEO_PAGE_HEADERS)
+            response.raise_for_status()
+            text = response.text
         
-        print(f"无法从页面提取播放量")
-        return 0
+        # 未能提前解析时，对已读取的页面使用完整解析
+        return parse_page_view_count(text, bv_id)
     except Exception as e:
-        print(f"备用方法获取失败: {e}")
+        logger.warning("备用方法获取失败: %s", e)
         return 0
 
-# 搜索YouTube
-def search_youtube(keyword, task_id=None, task_queue=None):
-    try:
-        print(f"开始搜索YouTube: {keyword}")
-        import urllib.parse
-        encoded_keyword = urllib.parse.quote(keyword)
-        
-        items = []
-        processed_ids = set()
-        page_token = None
-        max_pages = 2  # 最多获取2页数据，确保至少30个视频
-        current_page = 0
-        
-        # 初始化进度更新函数
-        def update_progress(progress):
-            if task_id and task_queue:
-                task_queue.put((task_id, 'youtube_progress', progress))
-                print(f"更新YouTube搜索进度: {progress}%")
+# 视频页流式解析：每次读取的块大小与最多读取的字节数
+BILIBILI_PAGE_STREAMING = True
+PAGE_STREAM_CHUNK_SIZE = 16 * 1024
+PAGE_STREAM_MAX_BYTES = 2 * 1024 * 1024
+INITIAL_STATE_MARKER = 'window.__INITIAL_STATE__'
+STAT_START_PATTERN = re.compile(r'"stat"\s*:\s*\{')
+# stat 对象中的 view 字段（数字后需跟 , 或 }，确保数字已完整读取）
+STAT_VIEW_PATTERN = re.compile(r'"view"\s*:\s*(\d+)\s*[,}]')
+
+def match_stat_view(text, start):
+    """只在 start 之后的第一个 stat 对象中查找 view，不会越过它匹配到相关推荐视频的 stat
+    
+    返回 (是否已判定, 播放量)：对象尚未读取完整时为 (False, None)；对象中没有 view 或含嵌套对象时为 (True, None)。
+    """
+    stat = STAT_START_PATTERN.search(text, start)
+    if stat is None:
+        return False, None
+    brace = re.compile(r'[{}]').search(text, stat.end())
+    if brace is None:
+        return False, None
+    if brace.group() == '{':
+        return True, None
+    view = STAT_VIEW_PATTERN.search(text, stat.end(), brace.end())
+    return True, int(view.group(1)) if view else None
+
+def stream_view_count(response):
+    """分块读取视频页并查找 __INITIAL_STATE__ 中的 videoData.stat.view
+    
+    返回 (播放量, 已读取的文本)；找到时立即停止读取。videoData 的第一个 stat 对象中没有 view 时
+    继续读取剩余页面并返回None，由调用方对文本做完整解析。
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    text = ''
+    marker_pos = video_data_pos = -1
+    stat_checked = False
+    read_bytes = 0
+    for chunk in response.iter_content(chunk_size=PAGE_STREAM_CHUNK_SIZE):
+        read_bytes += len(chunk)
+        scan_from = max(0, len(text) - 64)  # 与上一块重叠，避免标记被截断
+        text += decoder.decode(chunk)
         
-        update_progress(0)  # 初始进度
+        if marker_pos < 0:
+            marker_pos = text.find(INITIAL_STATE_MARKER, scan_from)
+            if marker_pos >= 0:
+                scan_from = marker_pos
+        if marker_pos >= 0 and video_data_pos < 0:
+            video_data_pos = text.find('"videoData"', max(scan_from, marker_pos))
+        if video_data_pos >= 0 and not stat_checked:
+            stat_checked, view_count = match_stat_view(text, video_data_pos)
+            if view_count is not None:
+                return view_count, text
         
-        # 获取YouTube视频的最大尝试次数
-        while len(items) < 30 and current_page < max_pages:
-            current_page += 1
-            print(f"获取YouTube搜索结果第 {current_page} 页")
-            
-            # 页面加载进度 (YouTube部分占用总进度的40%)
-            page_progress = (current_page - 1) * 15  # 每页大约15%的YouTube部分进度
-            update_progress(int(page_progress))
-            
-            # 使用YouTube Data API搜索视频
-            params = {
-                'part': 'snippet',
-                'q': keyword,
-                'type': 'video',
-                'maxResults': 30,  # 每页最多50个结果
-                'order': 'viewCount',  # 按播放量优先排序
-                'key': YOUTUBE_API_KEY
-            }
-            
-            # 如果有下一页令牌，添加到请求参数中
-            if page_token:
-                params['pageToken'] = page_token
-            
-            response = requests.get(YOUTUBE_API_URL, params=params, timeout=10)
-            response.raise_for_status()
-            search_results = response.json()
-            
-            # 提取视频ID列表
-            video_ids = [item['id']['videoId'] for item in search_results.get('items', [])]
-            print(f"第 {current_page} 页找到 {len(video_ids)} 个YouTube视频ID")
-            
-            # 如果没有找到视频，结束循环
-            if not video_ids:
-                break
-            
-            # 获取下一页令牌
-            page_token = search_results.get('nextPageToken')
-            
-            # 批量获取视频详细信息，包括播放量
-            # 将视频ID分批处理，确保不超出API限制
-            batch_size = 30
-            for i in range(0, len(video_ids), batch_size):
-                batch_video_ids = video_ids[i:i+batch_size]
-                
-                details_params = {
-                    'part': 'snippet,statistics',
-                    'id': ','.join(batch_video_ids),
-                    'key': YOUTUBE_API_KEY
-                }
-                
-                details_response = requests.get(YOUTUBE_VIDEO_DETAIL_URL, params=details_params, timeout=10)
-                details_response.raise_for_status()
-                video_details = details_response.json()
-                
-                # 获取本批次视频总数
-                total_batch_videos = len(video_details.get('items', []))
-                
-                # 解析结果
-                for idx, item in enumerate(video_details.get('items', [])):
-                    try:
-                        video_id = item['id']
-                        
-                        # 跳过已处理的视频ID
-                        if video_id in processed_ids:
-                            continue
-                        
-                        processed_ids.add(video_id)
-                        snippet = item.get('snippet', {})
-                        statistics = item.get('statistics', {})
-                        
-                        # 获取播放量，处理可能的缺失情况
-                        try:
-                            view_count = int(statistics.get('viewCount', 0))
-                        except (KeyError, ValueError, TypeError):
-                            view_count = 0
-                        
-                        # 获取YouTube视频缩略图URL
-                        thumbnail_url = snippet.get('thumbnails', {}).get('high', {}).get('url', '')
-                        if not thumbnail_url:
-                            # 使用默认的缩略图URL格式
-                            thumbnail_url = f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg"
-                        
-                        items.append({
-                            'title': snippet.get('title', ''),
-                            'url': f"https://www.youtube.com/watch?v={video_id}",
-                            'video_id': video_id,
-                            'view_count': view_count,
-                            'platform': 'youtube',
-                            'thumbnail_url': thumbnail_url
-                        })
-                        
-                        print(f"添加YouTube视频: {snippet.get('title', '')[:30]}..., 播放量: {view_count}")
-                        
-                        # 更新进度
-                        video_progress = page_progress + (idx + 1) * 25 / (max_pages * 50)  # 视频处理占25%的YouTube部分进度
-                        update_progress(min(int(video_progress), 90))
-                        
-                        # 达到目标数量，提前退出
-                        if len(items) >= 30:
-                            update_progress(90)
-                            break
-                            
-                    except Exception as e:
-                        print(f"处理YouTube视频失败: {e}")
-                        continue
-                
-                # 达到目标数量，提前退出
-                if len(items) >= 30:
+        if read_bytes >= PAGE_STREAM_MAX_BYTES:
+            break
+    return None, text + decoder.decode(b'', final=True)
+
+def parse_page_view_count(text, bv_id=''):
+    """从完整的视频页HTML中解析播放量，失败返回0"""
+    # 方法1：从页面中提取stat数据
+    stat_match = re.search(r'window\.__INITIAL_STATE__\s*=\s*(.*?);\s*\(function\(', text)
+    if stat_match:
+        try:
+            initial_data = json.loads(stat_match.group(1))
+            # 尝试不同的数据路径
+            if 'videoData' in initial_data and 'stat' in initial_data['videoData']:
+                view_count = initial_data['videoData']['stat'].get('view', 0)
+                log_item("从INITIAL_STATE获取播放量: %s", view_count)
+                return view_count
+            elif 'videoData' in initial_data:
+                view_count = initial_data['videoData'].get('stat', {}).get('view', 0)
+                log_item("从videoData获取播放量: %s", view_count)
+                return view_count
+            elif 'data' in initial_data and 'stat' in initial_data['data']:
+                view_count = initial_data['data']['stat'].get('view', 0)
+                log_item("从data.stat获取播放量: %s", view_count)
+                return view_count
+        except Exception as json_error:
+            logger.warning("解析JSON失败: %s", json_error)
+    
+    # 方法2：使用多种正则表达式提取播放量
+    view_patterns = [
+        r'"view"\s*:\s*(\d+)',
+        r'view="(\d+)"',
+        r'观看\s*<[^>]*>\s*(\d+)',
+        r'播放\s*<[^>]*>\s*(\d+)',
+        r'play\s*:\s*(\d+)'  
+    ]
+    
+    for pattern in view_patterns:
+        view_match = re.search(pattern, text)
+        if view_match:
+            view_count = int(view_match.group(1))
+            log_item("从正则 %s 获取播放量: %s", pattern, view_count)
+            return view_count
+    
+    logger.warning("无法从页面提取播放量: %s", bv_id)
+    return 0
+
+try:
+    YOUTUBE_QUOTA_TIMEZONE = ZoneInfo('America/Los_Angeles')
+except ZoneInfoNotFoundError:
+    YOUTUBE_QUOTA_TIMEZONE = timezone(timedelta(hours=-8))
+
+class YouTubeQuotaExceeded(Exception):
+    """YouTube配额不足且缓存中没有可用结果"""
+
+class YouTubeQuotaLedger:
+    """YouTube配额账本（SQLite）
+    
+    每次API调用记录一条流水（配额日、方法、消耗、任务ID），多个进程共享同一账本；
+    按配额日汇总得到当日用量，跨过太平洋时间午夜即自动重置。
+    """
+    
+    def __init__(self, path, daily_quota=None):
+        self.path = path
+        self.daily_quota = daily_quota or YOUTUBE_DAILY_QUOTA
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""CREATE TABLE IF NOT EXISTS quota_usage (
+            day TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            method TEXT NOT NULL,
+            units INTEGER NOT NULL,
+            task_id TEXT
+        )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_quota_usage_day ON quota_usage (day)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_quota_usage_task ON quota_usage (task_id)")
+    
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+    
+    @staticmethod
+    def quota_day(now=None):
+        """当前配额日（太平洋时间日期）"""
+        return datetime.fromtimestamp(now or time.time(), YOUTUBE_QUOTA_TIMEZONE).date().isoformat()
+    
+    @staticmethod
+    def seconds_until_reset(now=None):
+        current = datetime.fromtimestamp(now or time.time(), YOUTUBE_QUOTA_TIMEZONE)
+        next_day = datetime.combine(current.date() + timedelta(days=1), datetime.min.time(), YOUTUBE_QUOTA_TIMEZONE)
+        return max(0, int(next_day.timestamp() - current.timestamp()))
+    
+    def record(self, method, task_id=None, units=None):
+        """记录一次API调用的配额消耗"""
+        if units is None:
+            units = YOUTUBE_QUOTA_COSTS.get(method, 1)
+        now = time.time()
+        day = self.quota_day(now)
+        conn = self._conn()
+        conn.execute("INSERT INTO quota_usage (day, created_at, method, units, task_id) VALUES (?, ?, ?, ?, ?)",
+                     (day, now, method, units, task_id))
+        # 新的配额日开始时清理过期流水
+        if getattr(self._local, 'day', None) != day:
+            self._local.day = day
+            conn.execute("DELETE FROM quota_usage WHERE created_at < ?",
+                         (now - YOUTUBE_QUOTA_RETENTION_DAYS * 86400,))
+        return units
+    
+    def used(self, day=None):
+        row = self._conn().execute("SELECT COALESCE(SUM(units), 0) FROM quota_usage WHERE day = ?",
+                                   (day or self.quota_day(),)).fetchone()
+        return row[0]
+    
+    def remaining(self):
+        return max(0, self.daily_quota - self.used())
+    
+    def task_usage(self, task_id):
+        """某个任务消耗的配额，按方法分列"""
+        rows = self._conn().execute(
+            "SELECT method, COUNT(*), SUM(units) FROM quota_usage WHERE task_id = ? GROUP BY method", (task_id,))
+        usage = {method: {'calls': calls, 'units': units} for method, calls, units in rows}
+        return {'units': sum(item['units'] for item in usage.values()), 'by_method': usage}
+    
+    def mode(self, remaining=None):
+        """根据剩余额度决定搜索模式：normal / degraded（只搜一页）/ cache_only（只用缓存）"""
+        remaining = self.remaining() if remaining is None else remaining
+        if remaining < YOUTUBE_QUOTA_COSTS['search.list'] + YOUTUBE_QUOTA_COSTS['videos.list']:
+            return 'cache_only'
+        if remaining < YOUTUBE_QUOTA_DEGRADE_THRESHOLD:
+            return 'degraded'
+        return 'normal'
+    
+    def get_stats(self):
+        day = self.quota_day()
+        rows = self._conn().execute(
+            "SELECT method, COUNT(*), SUM(units) FROM quota_usage WHERE day = ? GROUP BY method", (day,))
+        by_method = {method: {'calls': calls, 'units': units} for method, calls, units in rows}
+        used = sum(item['units'] for item in by_method.values())
+        remaining = max(0, self.daily_quota - used)
+        return {
+            'day': day,
+            'daily_quota': self.daily_quota,
+            'used': used,
+            'remaining': remaining,
+            'mode': self.mode(remaining),
+            'seconds_until_reset': self.seconds_until_reset(),
+            'by_method': by_method
+        }
+
+youtube_quota = YouTubeQuotaLedger(YOUTUBE_QUOTA_DB_PATH)
+
+# 搜索结果页缓存：以 (关键词, 页令牌) 为键保存视频ID列表与下一页令牌，重复搜索不再消耗 search.list 配额
+youtube_search_cache = TwoTierCache('youtube_search', max_items=1000, ttl=YOUTUBE_SEARCH_CACHE_TTL,
+                                    stale_ttl=YOUTUBE_QUOTA_STALE_TTL)
+
+def youtube_item_metadata(item):
+    """从 videos.list 返回的条目提取元数据"""
+    video_id = item['id']
+    snippet = item.get('snippet', {})
+    statistics = item.get('statistics', {})
+    
+    # 获取播放量，处理可能的缺失情况
+    try:
+        view_count = int(statistics.get('viewCount', 0))
+    except (KeyError, ValueError, TypeError):
+        view_count = 0
+    
+    # 获取YouTube视频缩略图URL
+    thumbnail_url = snippet.get('thumbnails', {}).get('high', {}).get('url', '')
+    if not thumbnail_url:
+        # 使用默认的缩略图URL格式
+        thumbnail_url = f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg"
+    
+    return {
+        'title': snippet.get('title', ''),
+        'view_count': view_count,
+        'author': snippet.get('channelTitle', ''),
+        'thumbnail_url': thumbnail_url
+    }
+
+# 异步搜索YouTube
+async def search_youtube_async(keyword, max_results=None, max_pages=2, update_progress=None, task_id=None):
+    """按页搜索YouTube：第N页的详情请求与第N+1页的搜索请求并行
+    
+    配额接近用尽时降级：degraded 只搜索一页，cache_only 只使用缓存的搜索结果与视频详情；
+    两种模式下过期不超过 YOUTUBE_QUOTA_STALE_TTL 的缓存也直接使用，不再消耗配额刷新。
+    """
+    max_results = max_results or MERGE_MAX_PER_PLATFORM
+    items = []
+    processed_ids = set()
+    # 配额账本与缓存的SQLite读写均在线程池中执行，不阻塞共享事件循环
+    remaining = await asyncio.to_thread(youtube_quota.remaining)
+    quota_mode = youtube_quota.mode(remaining)
+    if quota_mode != 'normal':
+        logger.warning("YouTube配额剩余 %s，进入 %s 模式", remaining, quota_mode)
+    if quota_mode == 'degraded':
+        max_pages = 1
+    allow_stale = quota_mode != 'normal'
+    
+    async def fetch_page(page_token):
+        cache_key = f"{keyword}\n{page_token or ''}"
+        cached = await youtube_search_cache.get_async(cache_key, allow_stale)
+        if cached is not None:
+            return cached
+        if quota_mode == 'cache_only':
+            if page_token is None:
+                raise YouTubeQuotaExceeded("YouTube配额不足，且没有该关键词的缓存结果")
+            return {'video_ids': [], 'next_page_token': None}
+        
+        params = {
+            'part': 'snippet',
+            'q': keyword,
+            'type': 'video',
+            'maxResults': YOUTUBE_SEARCH_PAGE_SIZE,
+            'order': 'viewCount',  # 按播放量优先排序
+            'key': YOUTUBE_API_KEY
+        }
+        # 如果有下一页令牌，添加到请求参数中
+        if page_token:
+            params['pageToken'] = page_token
+        await asyncio.to_thread(youtube_quota.record, 'search.list', task_id)
+        with timing_span('youtube_search_page'):
+            search_results = await http_get_json_async(YOUTUBE_API_URL, params)
+        page = {
+            'video_ids': [item['id']['videoId'] for item in search_results.get('items', [])
+                          if item.get('id', {}).get('videoId')],
+            'next_page_token': search_results.get('nextPageToken')
+        }
+        await youtube_search_cache.set_async(cache_key, page)
+        return page
+    
+    async def fetch_details(video_ids):
+        """获取视频详情，只为未缓存的视频请求 videos.list"""
+        cached = await video_metadata_cache.get_many_async([f"youtube:{video_id}" for video_id in video_ids],
+                                                           allow_stale)
+        metadata = {video_id: cached[f"youtube:{video_id}"] for video_id in video_ids
+                    if f"youtube:{video_id}" in cached}
+        missing_ids = [video_id for video_id in video_ids if video_id not in metadata]
+        if quota_mode == 'cache_only':
+            return metadata
+        
+        # 按API上限分批，各批并发请求
+        batches = [missing_ids[i:i + YOUTUBE_DETAIL_BATCH_SIZE]
+                   for i in range(0, len(missing_ids), YOUTUBE_DETAIL_BATCH_SIZE)]
+        
+        def record_batches():
+            for batch in batches:
+                youtube_quota.record('videos.list', task_id)
+        
+        await asyncio.to_thread(record_batches)
+        with timing_span('youtube_details'):
+            responses = await asyncio.gather(*(
+                http_get_json_async(YOUTUBE_VIDEO_DETAIL_URL, {
+                    'part': 'snippet,statistics',
+                    'id': ','.join(batch),
+                    'key': YOUTUBE_API_KEY
+                }) for batch in batches
+            ))
+        fetched = {}
+        for video_details in responses:
+            for item in video_details.get('items', []):
+                try:
+                    fetched[item['id']] = youtube_item_metadata(item)
+                except Exception as e:
+                    logger.warning("处理YouTube视频失败: %s", e)
+        # 本批详情一次性写入缓存
+        await video_metadata_cache.set_many_async(
+            {f"youtube:{video_id}": item for video_id, item in fetched.items()})
+        metadata.update(fetched)
+        return metadata
+    
+    next_page = asyncio.ensure_future(fetch_page(None))
+    try:
+        for page in range(1, max_pages + 1):
+            page_task, next_page = next_page, None
+            logger.debug("获取YouTube搜索结果第 %s 页", page)
+            if update_progress:
+                update_progress((page - 1) * 15)  # 每页大约15%的YouTube部分进度
+            
+            search_page = await page_task
+            
+            # 提取视频ID列表（去重）
+            video_ids = []
+            for video_id in search_page['video_ids']:
+                if video_id not in processed_ids and video_id not in video_ids:
+                    video_ids.append(video_id)
+            logger.debug("第 %s 页找到 %s 个YouTube视频ID", page, len(video_ids))
+            
+            # 如果没有找到视频，结束循环
+            if not video_ids:
+                break
+            
+            # 本页视频ID不足以填满结果时，解析本页详情的同时预取下一页搜索结果（每页消耗100配额）
+            page_token = search_page['next_page_token']
+            has_next_page = bool(page_token) and page < max_pages
+            if has_next_page and len(video_ids) < max_results - len(items):
+                next_page = asyncio.ensure_future(fetch_page(page_token))
+            
+            metadata = await fetch_details(video_ids)
+            
+            # 按搜索结果顺序添加，跳过无详情的视频ID
+            for video_id in video_ids:
+                if len(items) >= max_results:
                     break
+                info = metadata.get(video_id)
+                if info is None:
+                    continue
+                
+                processed_ids.add(video_id)
+                items.append({
+                    'title': info['title'],
+                    'url': f"https://www.youtube.com/watch?v={video_id}",
+                    'video_id': video_id,
+                    'view_count': info['view_count'],
+                    'platform': 'youtube',
+                    'thumbnail_url': info['thumbnail_url']
+                })
+                log_item("添加YouTube视频: %s..., 播放量: %s", info['title'][:30], info['view_count'])
+            
+            if update_progress:
+                update_progress(min(page * 40, 90))
+            
+            # 部分视频缺少详情导致结果不足时，再请求下一页
+            if next_page is None and has_next_page and len(items) < max_results:
+                next_page = asyncio.ensure_future(fetch_page(page_token))
             
-            # 如果没有下一页或者已经获取足够的视频，结束循环
-            if not page_token or len(items) >= 30:
+            # 已获取足够的视频或没有下一页，结束循环
+            if next_page is None or len(items) >= max_results:
                 break
+    finally:
+        # 取消不再需要（或因异常未使用）的预取请求
+        if next_page is not None and not next_page.done():
+            next_page.cancel()
+    
+    if not items and quota_mode == 'cache_only':
+        raise YouTubeQuotaExceeded("YouTube配额不足，且缓存中没有该关键词的视频详情")
+    return items
+
+# 搜索YouTube
+def search_youtube(keyword, task_id=None, task_queue=None):
+    try:
+        logger.info("开始搜索YouTube: %s", keyword)
+        
+        # 初始化进度更新函数
+        def update_progress(progress):
+            if task_id and task_queue:
+                task_queue.put((task_id, 'youtube_progress', progress))
+                log_item("更新YouTube搜索进度: %s%%", progress)
+        
+        update_progress(0)  # 初始进度
+        
+        try:
+            items = run_async(search_youtube_async(keyword, update_progress=update_progress, task_id=task_id))
+        except YouTubeQuotaExceeded as e:
+            # 配额耗尽时不返回模拟数据，把原因记录到任务错误中
+            logger.warning("YouTube搜索跳过: %s", e)
+            if task_id:
+                add_task_error(task_id, str(e))
+            return []
+        finally:
+            if task_id:
+                update_task(task_id, youtube_quota=youtube_quota.task_usage(task_id))
         
         # 如果没有找到视频，添加一些模拟数据用于测试
         if not items:
-            print("YouTube搜索未找到视频，添加模拟数据用于测试...")
+            logger.warning("YouTube搜索未找到视频，添加模拟数据用于测试...")
             mock_data = [
                   {
                       'title': 'Python Tutorial for Beginners',
@@ -805,41 +1926,20 @@ def search_youtube(keyword, task_id=None, task_queue=None):
         # 按播放量降序排序
         items.sort(key=lambda x: x['view_count'], reverse=True)
         update_progress(90)  # 排序完成进度
-        print(f"YouTube搜索完成，获取到 {len(items)} 个视频")
+        logger.info("YouTube搜索完成，获取到 %s 个视频", len(items))
         return items
     except Exception as e:
-        print(f"YouTube搜索失败: {str(e)}")
+        logger.error("YouTube搜索失败: %s", e)
         return []
 
 import numpy as np
 from PIL import Image
-import requests
 from io import BytesIO
 
 # 合并相同视频
 def merge_videos(videos, image_merge=False):
     """合并相似视频，按照播放量降序排序，高播放量优先匹配"""
-    print(f"开始合并 {len(videos)} 个视频，缩略图匹配: {image_merge}")
-    
-    # 预处理所有视频的缩略图向量（如果启用）
-    if image_merge:
-        print("预处理缩略图向量...")
-        for video in videos:
-            # 确保每个视频都有thumbnail_url字段
-            if 'thumbnail_url' not in video:
-                video_id = video.get('video_id', video.get('bv_id', 'default'))
-                if video['platform'] == 'youtube':
-                    video['thumbnail_url'] = f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg"
-                else:
-                    video['thumbnail_url'] = f"https://picsum.photos/seed/{video_id}/320/180"
-                print(f"为视频添加默认缩略图URL: {video['thumbnail_url']}")
-            
-            print(f"获取向量url: {video['thumbnail_url']}")
-            try:
-                video['thumbnail_vector'] = get_image_vector(video['thumbnail_url'])
-            except Exception as e:
-                print(f"获取缩略图向量失败: {e}")
-                video['thumbnail_vector'] = None
+    logger.info("开始合并 %s 个视频，缩略图匹配: %s", len(videos), image_merge)
     
     # 分离两个平台的视频并按播放量降序排序
     bilibili_videos = [v for v in videos if v['platform'] == 'bilibili']
@@ -850,14 +1950,23 @@ def merge_videos(videos, image_merge=False):
     youtube_videos.sort(key=lambda x: x['view_count'], reverse=True)
     
     for bilibili_video in bilibili_videos:
-        print(f"B站视频: {bilibili_video['title'][:30]}..., 播放量: {bilibili_video['view_count']}")
+        log_item("B站视频: %s..., 播放量: %s", bilibili_video['title'][:30], bilibili_video['view_count'])
     for youtube_video in youtube_videos:
-        print(f"YouTube视频: {youtube_video['title'][:30]}..., 播放量: {youtube_video['view_count']}")
-    # 只取前50个视频
-    bilibili_videos = bilibili_videos[:30]
-    youtube_videos = youtube_videos[:30]
+        log_item("YouTube视频: %s..., 播放量: %s", youtube_video['title'][:30], youtube_video['view_count'])
+    # 每个平台只取前 MERGE_MAX_PER_PLATFORM 个视频参与匹配
+    bilibili_videos = bilibili_videos[:MERGE_MAX_PER_PLATFORM]
+    youtube_videos = youtube_videos[:MERGE_MAX_PER_PLATFORM]
     
-    print(f"B站视频: {len(bilibili_videos)} 个，YouTube视频: {len(youtube_videos)} 个")
+    logger.debug("B站视频: %s 个，YouTube视频: %s 个", len(bilibili_videos), len(youtube_videos))
+    
+    # 预处理参与匹配的视频的缩略图向量（如果启用）
+    if image_merge:
+        logger.debug("预处理缩略图向量...")
+        with timing_span('thumbnail_vectors'):
+            compute_thumbnail_vectors(bilibili_videos + youtube_videos)
+    
+    # 批量计算相似度矩阵并按播放量从高到低贪心匹配
+    matches = match_videos(bilibili_videos, youtube_videos, image_merge)
     
     # 标记YouTube视频是否已被合并
     youtube_merged = [False] * len(youtube_videos)
@@ -881,47 +1990,22 @@ def merge_videos(videos, image_merge=False):
             }
         }
         
-        # 尝试匹配YouTube视频
-        matched = False
-        # 从高播放量到低播放量遍历未合并的YouTube视频
-        for yt_idx, yt_video in enumerate(youtube_videos):
-            if not youtube_merged[yt_idx]:
-                # 计算标题相似度
-                bili_title_simple = re.sub(r'[\s\n\r\t\-_,\.!\?"\'\(\)]+', ' ', bili_video['title']).strip().lower()
-                yt_title_simple = re.sub(r'[\s\n\r\t\-_,\.!\?"\'\(\)]+', ' ', yt_video['title']).strip().lower()
-                similarity = calculate_similarity(bili_title_simple, yt_title_simple)
-                
-                # 计算缩略图相似度（如果启用）
-                image_similarity = 0
-                if image_merge and bili_video.get('thumbnail_vector') is not None and yt_video.get('thumbnail_vector') is not None:
-                    try:
-                        image_similarity = calculate_cosine_similarity(bili_video['thumbnail_vector'], yt_video['thumbnail_vector'])
-                    except Exception as e:
-                        print(f"计算缩略图相似度失败: {e}")
-                
-                # 如果标题相似度高于80%或者缩略图相似度达到阈值（0.8），则认为是同一视频
-                if similarity > 0.8 or (image_merge and image_similarity > 0.95):
-                    # 合并视频
-                    merged_item['total_views'] += yt_video['view_count']
-                    merged_item['platforms'][yt_video['platform']] = {
-                        'url': yt_video['url'],
-                        'views': yt_video['view_count']
-                    }
-                    # 更新主平台（播放量高的作为主平台）
-                    if yt_video['view_count'] > bili_video['view_count']:
-                        merged_item['main_platform'] = yt_video['platform']
-                        merged_item['main_url'] = yt_video['url']
-                    
-                    # 标记YouTube视频已合并
-                    youtube_merged[yt_idx] = True
-                    matched = True
-                    
-                    # 记录合并原因
-                    if similarity > 0.8 and (not image_merge or image_similarity <= 0.95):
-                        print(f"标题匹配合并: B站视频 {bili_idx+1} 与 YouTube视频 {yt_idx+1}")
-                    elif image_merge and image_similarity > 0.95:
-                        print(f"缩略图匹配合并: B站视频 {bili_idx+1} 与 YouTube视频 {yt_idx+1}, 缩略图相似度: {image_similarity:.2f}")
-                    break
+        yt_idx = matches[bili_idx]
+        if yt_idx is not None:
+            yt_video = youtube_videos[yt_idx]
+            # 合并视频
+            merged_item['total_views'] += yt_video['view_count']
+            merged_item['platforms'][yt_video['platform']] = {
+                'url': yt_video['url'],
+                'views': yt_video['view_count']
+            }
+            # 更新主平台（播放量高的作为主平台）
+            if yt_video['view_count'] > bili_video['view_count']:
+                merged_item['main_platform'] = yt_video['platform']
+                merged_item['main_url'] = yt_video['url']
+            
+            # 标记YouTube视频已合并
+            youtube_merged[yt_idx] = True
         
         # 添加到合并结果
         merged.append(merged_item)
@@ -944,82 +2028,408 @@ def merge_videos(videos, image_merge=False):
     
     # 按总播放量排序
     merged.sort(key=lambda x: x['total_views'], reverse=True)
-    print(f"合并排序完成，共 {len(merged)} 个视频")
+    logger.info("合并排序完成，共 %s 个视频", len(merged))
     
     # 检查处理情况
     merged_count = sum(1 for merged_flag in youtube_merged if merged_flag)
-    print(f"成功合并 {merged_count} 对视频")
+    logger.info("成功合并 %s 对视频", merged_count)
     
     return merged[:30]  # 返回前50个合并后的视频
 
+# 标题相似度与缩略图相似度的合并阈值
+TITLE_SIMILARITY_THRESHOLD = 0.8
+IMAGE_SIMILARITY_THRESHOLD = 0.95
+# 标题归一化时视为分隔符的字符
+TITLE_SEPARATOR_PATTERN = re.compile(r'[\s\n\r\t\-_,\.!\?"\'\(\)]+')
+
+def tokenize_title(title):
+    """归一化标题并分词"""
+    return set(TITLE_SEPARATOR_PATTERN.sub(' ', title).strip().lower().split())
+
+def build_title_similarity_matrix(titles_a, titles_b):
+    """批量计算两组标题之间的Jaccard相似度矩阵"""
+    tokens_a = [tokenize_title(title) for title in titles_a]
+    tokens_b = [tokenize_title(title) for title in titles_b]
+    if not tokens_a or not tokens_b:
+        return np.zeros((len(tokens_a), len(tokens_b)))
+    
+    # 只有两组共有的词会影响交集，词表仅包含这些词
+    shared = set().union(*tokens_a) & set().union(*tokens_b)
+    vocab = {token: idx for idx, token in enumerate(shared)}
+    
+    def incidence(token_sets):
+        matrix = np.zeros((len(token_sets), len(vocab)), dtype=np.float64)
+        for row, tokens in enumerate(token_sets):
+            cols = [vocab[token] for token in tokens if token in vocab]
+            matrix[row, cols] = 1
+        return matrix
+    
+    intersection = incidence(tokens_a) @ incidence(tokens_b).T
+    sizes_a = np.array([len(tokens) for tokens in tokens_a], dtype=np.float64)
+    sizes_b = np.array([len(tokens) for tokens in tokens_b], dtype=np.float64)
+    union = sizes_a[:, None] + sizes_b[None, :] - intersection
+    
+    # 并集为空时相似度为0
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+def build_thumbnail_similarity_matrix(vectors_a, vectors_b):
+    """批量计算两组缩略图向量之间的余弦相似度矩阵，缺失的向量相似度为0"""
+    def unit_matrix(vectors):
+        dim = next((len(v) for v in vectors if v is not None), 0)
+        matrix = np.zeros((len(vectors), dim), dtype=np.float32)
+        for row, vector in enumerate(vectors):
+            if vector is not None:
+                matrix[row] = vector
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+    
+    units_a = unit_matrix(vectors_a)
+    units_b = unit_matrix(vectors_b)
+    if units_a.shape[1] == 0 or units_a.shape[1] != units_b.shape[1]:
+        return np.zeros((len(vectors_a), len(vectors_b)), dtype=np.float32)
+    return units_a @ units_b.T
+
+def match_videos(bilibili_videos, youtube_videos, image_merge=False):
+    """按播放量从高到低贪心匹配，返回每个B站视频匹配到的YouTube视频下标（未匹配为None）
+    
+    两个列表均需已按播放量降序排序。
+    """
+    matches = [None] * len(bilibili_videos)
+    if not bilibili_videos or not youtube_videos:
+        return matches
+    
+    title_similarity = build_title_similarity_matrix(
+        [v['title'] for v in bilibili_videos], [v['title'] for v in youtube_videos])
+    candidates = title_similarity > TITLE_SIMILARITY_THRESHOLD
+    
+    image_similarity = None
+    hash_distance = None
+    if image_merge and THUMBNAIL_MATCH_METHOD == 'vector':
+        image_similarity = build_thumbnail_similarity_matrix(
+            [v.get('thumbnail_vector') for v in bilibili_videos],
+            [v.get('thumbnail_vector') for v in youtube_videos])
+        candidates |= image_similarity > IMAGE_SIMILARITY_THRESHOLD
+    elif image_merge:
+        # 感知哈希：通过汉明距离索引查找每个B站缩略图的近邻
+        hash_distance = {}
+        index = HammingIndex()
+        for yt_idx, yt_video in enumerate(youtube_videos):
+            if yt_video.get('thumbnail_hash') is not None:
+                index.add(yt_video['thumbnail_hash'], yt_idx)
+        for bili_idx, bili_video in enumerate(bilibili_videos):
+            if bili_video.get('thumbnail_hash') is None:
+                continue
+            for yt_idx, distance in index.search(bili_video['thumbnail_hash'], THUMBNAIL_HASH_MAX_DISTANCE):
+                candidates[bili_idx, yt_idx] = True
+                hash_distance[bili_idx, yt_idx] = distance
+    
+    available = np.ones(len(youtube_videos), dtype=bool)
+    for bili_idx in range(len(bilibili_videos)):
+        # 取播放量最高的、尚未合并的候选YouTube视频
+        hits = np.flatnonzero(candidates[bili_idx] & available)
+        if not len(hits):
+            continue
+        yt_idx = int(hits[0])
+        available[yt_idx] = False
+        matches[bili_idx] = yt_idx
+        
+        # 记录合并原因
+        if image_similarity is not None and image_similarity[bili_idx, yt_idx] > IMAGE_SIMILARITY_THRESHOLD:
+            log_item("缩略图匹配合并: B站视频 %s 与 YouTube视频 %s, 缩略图相似度: %.2f", bili_idx + 1, yt_idx + 1, image_similarity[bili_idx, yt_idx])
+        elif hash_distance is not None and (bili_idx, yt_idx) in hash_distance:
+            log_item("缩略图哈希匹配合并: B站视频 %s 与 YouTube视频 %s, 汉明距离: %s", bili_idx + 1, yt_idx + 1, hash_distance[bili_idx, yt_idx])
+        else:
+            log_item("标题匹配合并: B站视频 %s 与 YouTube视频 %s", bili_idx + 1, yt_idx + 1)
+    
+    return matches
+
+# 缩略图向量化阶段的并发数与总截止时间（秒）
+THUMBNAIL_VECTOR_WORKERS = 8
+THUMBNAIL_VECTOR_DEADLINE = 15
+# 缩略图匹配方式：'vector'（32x32x3向量余弦相似度）或 'phash'/'dhash'（64位感知哈希汉明距离）
+THUMBNAIL_MATCH_METHOD = 'vector'
+# 感知哈希匹配的最大汉明距离
+THUMBNAIL_HASH_MAX_DISTANCE = 10
+
+def compute_thumbnail_vectors(videos, max_workers=None, deadline=None, method=None):
+    """并发获取视频缩略图向量（或感知哈希），未在截止时间内完成的视频回退为仅标题匹配"""
+    method = method or THUMBNAIL_MATCH_METHOD
+    if method == 'vector':
+        field, compute = 'thumbnail_vector', get_image_vector
+    else:
+        field, compute = 'thumbnail_hash', lambda url: get_image_hash(url, method)
+    
+    for video in videos:
+        # 确保每个视频都有thumbnail_url字段
+        if 'thumbnail_url' not in video:
+            video_id = video.get('video_id', video.get('bv_id', 'default'))
+            if video['platform'] == 'youtube':
+                video['thumbnail_url'] = f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg"
+            else:
+                video['thumbnail_url'] = f"https://picsum.photos/seed/{video_id}/320/180"
+            log_item("为视频添加默认缩略图URL: %s", video['thumbnail_url'])
+        video[field] = None
+    
+    if not videos:
+        return
+    
+    executor = ThreadPoolExecutor(max_workers=max_workers or THUMBNAIL_VECTOR_WORKERS)
+    try:
+        futures = {submit_with_context(executor, compute, video['thumbnail_url']): video for video in videos}
+        done, not_done = wait(futures, timeout=deadline or THUMBNAIL_VECTOR_DEADLINE)
+        
+        for future in done:
+            try:
+                futures[future][field] = future.result()
+            except Exception as e:
+                logger.warning("获取缩略图向量失败: %s", e)
+        
+        if not_done:
+            logger.info("%s 个缩略图未在截止时间内完成，改为仅标题匹配", len(not_done))
+    finally:
+        # 不等待超时的下载，未开始的任务直接取消
+        executor.shutdown(wait=False, cancel_futures=True)
+
 def calculate_cosine_similarity(vec1, vec2):
     """计算两个向量的余弦相似度"""
+    vec1 = np.asarray(vec1, dtype=np.float64)
+    vec2 = np.asarray(vec2, dtype=np.float64)
+    norm1 = np.linalg.norm(vec1)
+    norm2 = np.linalg.norm(vec2)
     # 避免除零错误
-    if np.linalg.norm(vec1) == 0 or np.linalg.norm(vec2) == 0:
+    if norm1 == 0 or norm2 == 0:
         return 0
-    return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
+    return np.dot(vec1, vec2) / (norm1 * norm2)
 
-def get_image_vector(image_url):
-    """从图片URL获取图片向量表示"""
-    print(f"尝试获取图片向量: {image_url}")
+# 缩略图向量缓存（按 thumbnail_vector_cache_key：流程版本、解码方式与图片URL），命中时跳过下载与图片处理。
+# 向量以 float32 ndarray 保存（32×32×3 维约12KB，Python列表约100KB），只在JSON序列化时转换为列表
+THUMBNAIL_CACHE_MAX_ITEMS = 2048
+THUMBNAIL_CACHE_TTL = 7 * 24 * 3600
+
+thumbnail_vector_cache = TwoTierCache(
+    'thumbnail_vectors',
+    max_items=THUMBNAIL_CACHE_MAX_ITEMS,
+    ttl=THUMBNAIL_CACHE_TTL,
+    dumps=lambda vector: np.asarray(vector, dtype=np.float32).tobytes(),
+    loads=lambda blob: np.frombuffer(blob, dtype=np.float32)
+)
+
+# 缩略图快速解码：JPEG按DCT缩放在解码时直接缩小（draft），去黑边在缩小后的图上进行。
+# 与完整解码路径的向量等价性（余弦相似度，benchmark.py --check-equivalence 可复核）：
+#   - 无黑边的缩略图 ≥ 0.998；
+#   - 带黑边时，完整分辨率下黑边边缘的JPEG振铃可能使裁剪位置相差几行，最低约 0.97。
+# 两个平台的缩略图走同一条路径，且向量缓存键包含解码方式，因此同一张图在两边得到的向量仍然一致。
+THUMBNAIL_FAST_DECODE = True
+THUMBNAIL_DRAFT_MIN_SIZE = 64  # 缩小解码后宽高均不小于此值
+THUMBNAIL_FAST_DECODE_TOLERANCE = 0.97  # 与完整解码路径向量的最低余弦相似度
+THUMBNAIL_VECTOR_SIZE = (32, 32)
+# 向量处理流程的版本，流程改变时递增，使旧的缓存向量不再被读取
+THUMBNAIL_VECTOR_PIPELINE_VERSION = 2
+
+def thumbnail_vector_cache_key(image_url):
+    """向量缓存键：流程版本 + 解码方式（reduced/full）+ 图片URL"""
+    decode = 'reduced' if THUMBNAIL_FAST_DECODE else 'full'
+    return f"v{THUMBNAIL_VECTOR_PIPELINE_VERSION}:{decode}:{image_url}"
+
+def find_content_box(arr, min_size=8):
+    """在RGB数组中定位去黑边后的内容区域，返回 (left, top, right, bottom)（右下为开区间），无需裁剪时返回None
+    
+    每像素最大通道值 ≤ 10 视为“黑”，黑像素占比 ≥ 95% 的行/列视为黑边；裁剪后宽高均需不小于 min_size。
+    """
+    dark_mask = arr.max(axis=2) <= 10
+    rows = np.flatnonzero(dark_mask.mean(axis=1) < 0.95)
+    cols = np.flatnonzero(dark_mask.mean(axis=0) < 0.95)
+    if rows.size == 0 or cols.size == 0:
+        return None
+    top, bottom = rows[0], rows[-1] + 1
+    left, right = cols[0], cols[-1] + 1
+    if right - left < max(min_size, 2) or bottom - top < max(min_size, 2):
+        return None
+    if (left, top, right, bottom) == (0, 0, arr.shape[1], arr.shape[0]):
+        return None
+    return int(left), int(top), int(right), int(bottom)
+
+def crop_black_borders(img, min_size=8):
+    """去黑边处理（裁掉上下左右的黑边），失败时返回原图"""
     try:
-        # 设置超时以避免长时间等待
-        response = requests.get(image_url, timeout=10)
+        box = find_content_box(np.asarray(img), min_size)
+        if box:
+            img = img.crop(box)
+            log_item("已去黑边: left=%s, top=%s, right=%s, bottom=%s", box[0], box[1], box[2] - 1, box[3] - 1)
+    except Exception as ce:
+        logger.warning("去黑边失败，使用原图: %s", ce)
+    return img
+
+def download_thumbnail(image_url):
+    """下载缩略图，返回原始字节"""
+    with timing_span('thumbnail_download'):
+        response = http_get(image_url)
         response.raise_for_status()
-        
+        return response.content
+
+def fetch_thumbnail_image(image_url):
+    """下载缩略图，统一为RGB并去黑边"""
+    content = download_thumbnail(image_url)
+    
+    with timing_span('image_decode'):
         # 打开图片（保留颜色信息，统一为RGB三通道）
-        img = Image.open(BytesIO(response.content))
+        img = Image.open(BytesIO(content))
         img = img.convert('RGB')
         
-        # 在调整大小前，进行简单的去黑边处理（裁掉上下左右的黑边）
-        try:
-            arr = np.array(img)
-            h, w, _ = arr.shape
-            # 使用每像素最大通道值作为亮度，阈值10视为“黑”
-            brightness = arr.max(axis=2)
-            dark_mask = brightness <= 10
-            
-            # 计算每行/每列黑像素占比
-            row_dark_ratio = dark_mask.mean(axis=1)
-            col_dark_ratio = dark_mask.mean(axis=0)
-            
-            # 寻找顶部、底部、左侧、右侧的非黑边界（< 95%黑像素）
-            top = 0
-            while top < h and row_dark_ratio[top] >= 0.95:
-                top += 1
-            bottom = h - 1
-            while bottom > top and row_dark_ratio[bottom] >= 0.95:
-                bottom -= 1
-            left = 0
-            while left < w and col_dark_ratio[left] >= 0.95:
-                left += 1
-            right = w - 1
-            while right > left and col_dark_ratio[right] >= 0.95:
-                right -= 1
-            
-            # 保证裁剪后尺寸合理
-            if right - left + 1 >= 8 and bottom - top + 1 >= 8 and left < right and top < bottom:
-                img = img.crop((left, top, right + 1, bottom + 1))
-                print(f"已去黑边: left={left}, top={top}, right={right}, bottom={bottom}")
-        except Exception as ce:
-            print(f"去黑边失败，使用原图: {ce}")
-        
-        # 去黑边后调整大小以统一维度
-        img = img.resize((32, 32))  # 缩小尺寸以提高性能
-        
-        # 转换为numpy数组并展平为向量
-        vector = np.array(img).flatten()
-        
-        # 归一化向量
-        norm = np.linalg.norm(vector)
-        if norm > 0:
-            vector = vector / norm
-        
-        # 返回Python列表而不是NumPy数组，避免JSON序列化问题
-        return vector.tolist()
+        # 在调整大小前，进行简单的去黑边处理
+        return crop_black_borders(img)
+
+def decode_thumbnail_reduced(content, min_size=None):
+    """解码时缩小图片（仅JPEG），统一为RGB并去黑边"""
+    min_size = min_size or THUMBNAIL_DRAFT_MIN_SIZE
+    img = Image.open(BytesIO(content))
+    original_width = img.size[0]
+    if img.format == 'JPEG':
+        img.draft('RGB', (min_size, min_size))
+    img = img.convert('RGB')
+    # 去黑边的最小尺寸（原图8像素）按缩小比例换算
+    scale = img.size[0] / original_width
+    return crop_black_borders(img, min_size=max(1, math.ceil(8 * scale)))
+
+def image_to_vector(img):
+    """缩放到统一尺寸后展平为L2归一化的向量（float32 ndarray，JSON序列化时由 dumps_json 转换）"""
+    vector = np.asarray(img.resize(THUMBNAIL_VECTOR_SIZE), dtype=np.float64).ravel()
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector = vector / norm
+    return vector.astype(np.float32)
+
+def get_image_vector(image_url):
+    """从图片URL获取图片向量表示"""
+    cache_key = thumbnail_vector_cache_key(image_url)
+    cached = thumbnail_vector_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    log_item("尝试获取图片向量: %s", image_url)
+    try:
+        if THUMBNAIL_FAST_DECODE:
+            content = download_thumbnail(image_url)
+            with timing_span('image_decode'):
+                img = decode_thumbnail_reduced(content)
+        else:
+            img = fetch_thumbnail_image(image_url)
+        
+        vector = image_to_vector(img)
+        thumbnail_vector_cache.set(cache_key, vector)
+        return vector
+    except Exception as e:
+        raise Exception(f"处理图片失败: {str(e)}")
+
+# 缩略图感知哈希缓存（按哈希方法与图片URL）
+thumbnail_hash_cache = TwoTierCache(
+    'thumbnail_hashes',
+    max_items=THUMBNAIL_CACHE_MAX_ITEMS * 4,
+    ttl=THUMBNAIL_CACHE_TTL
+)
+
+def _dct_matrix(n):
+    """n点DCT-II正交变换矩阵"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.sqrt(2 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+_PHASH_DCT = _dct_matrix(32)
+
+def compute_image_hash(img, method='phash'):
+    """计算图片的64位感知哈希（phash 或 dhash），返回整数"""
+    gray = img.convert('L')
+    if method == 'dhash':
+        # 差异哈希：9x8灰度图中相邻像素的亮度梯度
+        pixels = np.asarray(gray.resize((9, 8), Image.LANCZOS), dtype=np.float64)
+        bits = pixels[:, 1:] > pixels[:, :-1]
+    elif method == 'phash':
+        # 感知哈希：32x32灰度图做二维DCT，取左上角8x8低频系数与其中位数比较
+        pixels = np.asarray(gray.resize((32, 32), Image.LANCZOS), dtype=np.float64)
+        low = (_PHASH_DCT @ pixels @ _PHASH_DCT.T)[:8, :8]
+        # 中位数计算排除直流分量
+        bits = low > np.median(low.flatten()[1:])
+    else:
+        raise ValueError(f"不支持的哈希方法: {method}")
+    return int(np.packbits(bits.flatten()).view('>u8')[0])
+
+def get_image_hash(image_url, method='phash'):
+    """从图片URL获取去黑边后的64位感知哈希"""
+    cache_key = f"{method}:{image_url}"
+    cached = thumbnail_hash_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    log_item("尝试获取图片哈希: %s", image_url)
+    try:
+        fingerprint = compute_image_hash(fetch_thumbnail_image(image_url), method)
+        thumbnail_hash_cache.set(cache_key, fingerprint)
+        return fingerprint
     except Exception as e:
         raise Exception(f"处理图片失败: {str(e)}")
 
+def hamming_distance(hash1, hash2):
+    """两个64位哈希之间的汉明距离"""
+    return bin(hash1 ^ hash2).count('1')
+
+class HammingIndex:
+    """64位指纹的汉明距离索引（多索引哈希）
+    
+    指纹被切分为若干段，每段各建一张哈希表。根据鸽巢原理，距离不超过r的两个指纹
+    至少有一段的距离不超过 r // 段数，因此只需在每张表中探测少量邻近键即可找出全部候选。
+    """
+    
+    def __init__(self, chunks=4):
+        self.chunks = chunks
+        self.chunk_bits = 64 // chunks
+        self._chunk_mask = (1 << self.chunk_bits) - 1
+        self._tables = [{} for _ in range(chunks)]
+        self._items = []  # (fingerprint, value)
+        self._flip_masks = {}
+    
+    def __len__(self):
+        return len(self._items)
+    
+    def _chunk(self, fingerprint, index):
+        return (fingerprint >> (index * self.chunk_bits)) & self._chunk_mask
+    
+    def _masks(self, radius):
+        # 段内距离不超过radius的所有翻转掩码
+        if radius not in self._flip_masks:
+            masks = [0]
+            for r in range(1, radius + 1):
+                for bits in itertools.combinations(range(self.chunk_bits), r):
+                    masks.append(sum(1 << b for b in bits))
+            self._flip_masks[radius] = masks
+        return self._flip_masks[radius]
+    
+    def add(self, fingerprint, value=None):
+        """添加指纹，value为检索时返回的关联值"""
+        item_id = len(self._items)
+        self._items.append((fingerprint, value))
+        for index, table in enumerate(self._tables):
+            table.setdefault(self._chunk(fingerprint, index), []).append(item_id)
+    
+    def search(self, fingerprint, max_distance):
+        """返回汉明距离不超过max_distance的 (value, distance) 列表，按距离、添加顺序排序"""
+        masks = self._masks(max_distance // self.chunks)
+        seen = set()
+        results = []
+        for index, table in enumerate(self._tables):
+            key = self._chunk(fingerprint, index)
+            for mask in masks:
+                for item_id in table.get(key ^ mask, ()):
+                    if item_id in seen:
+                        continue
+                    seen.add(item_id)
+                    distance = hamming_distance(fingerprint, self._items[item_id][0])
+                    if distance <= max_distance:
+                        results.append((distance, item_id))
+        results.sort()
+        return [(self._items[item_id][1], distance) for distance, item_id in results]
+
 # 计算两个字符串的相似度（使用简单的Jaccard相似度）
 def calculate_similarity(str1, str2):
     try:
@@ -1047,12 +2457,274 @@ def format_number(num):
         return f"{num/10000:.1f}万"
     return str(num)
 
+def format_results(merged_videos):
+    """为合并结果添加格式化的播放量显示"""
+    for video in merged_videos:
+        video['formatted_total'] = format_number(video['total_views'])
+        for platform in video['platforms']:
+            video['platforms'][platform]['formatted_views'] = format_number(video['platforms'][platform]['views'])
+    return merged_videos
+
+# 搜索任务调度：固定数量的工作线程 + 有界队列，按客户端轮询出队保证公平
+SCHEDULER_WORKERS = 4
+SCHEDULER_MAX_QUEUE = 50
+SCHEDULER_MAX_QUEUED_PER_CLIENT = 5
+
+class TaskScheduler:
+    """有界的搜索任务调度器，队列已满时拒绝新任务"""
+    
+    def __init__(self, workers=SCHEDULER_WORKERS, max_queue=SCHEDULER_MAX_QUEUE,
+                 max_per_client=SCHEDULER_MAX_QUEUED_PER_CLIENT):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_per_client = max_per_client
+        self._queues = OrderedDict()  # client_id -> deque[(task_id, func, args, enqueued_at)]
+        self._size = 0
+        self._running = 0
+        self._avg_duration = 30.0  # 任务平均耗时估计（秒），用于计算Retry-After
+        self._cond = threading.Condition()
+        self._threads = []
+    
+    def _ensure_workers(self):
+        # 首次提交任务时才启动工作线程
+        if not self._threads:
+            for i in range(self.workers):
+                worker = threading.Thread(target=self._work, name=f"search-worker-{i}")
+                worker.daemon = True
+                worker.start()
+                self._threads.append(worker)
+    
+    def submit(self, client_id, task_id, func, *args):
+        """提交任务，队列已满（总量或该客户端）时返回False"""
+        with self._cond:
+            client_queue = self._queues.get(client_id)
+            if self._size >= self.max_queue or (client_queue and len(client_queue) >= self.max_per_client):
+                return False
+            self._queues.setdefault(client_id, deque()).append((task_id, func, args, time.time()))
+            self._size += 1
+            self._ensure_workers()
+            self._cond.notify()
+            return True
+    
+    def _next(self):
+        # 轮询：取队首客户端的一个任务，若该客户端仍有任务则移到末尾
+        client_id, client_queue = next(iter(self._queues.items()))
+        item = client_queue.popleft()
+        del self._queues[client_id]
+        if client_queue:
+            self._queues[client_id] = client_queue
+        self._size -= 1
+        return item
+    
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._size:
+                    self._cond.wait()
+                task_id, func, args, enqueued_at = self._next()
+                self._running += 1
+            
+            started_at = time.time()
+            try:
+                # 写入失败（如存储繁忙超时）也不能让工作线程退出
+                update_task(task_id, queue_wait=round(started_at - enqueued_at, 3))
+                func(*args)
+            except Exception as e:
+                logger.exception("任务 %s 执行失败: %s", task_id, e)
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._avg_duration = 0.8 * self._avg_duration + 0.2 * (time.time() - started_at)
+    
+    def queue_status(self, task_id):
+        """返回排队中任务的位置、队列深度与已等待时间，不在队列中时返回None"""
+        with self._cond:
+            for client_queue in self._queues.values():
+                for position, (queued_id, _, _, enqueued_at) in enumerate(client_queue):
+                    if queued_id == task_id:
+                        return {
+                            'queue_position': position + 1,
+                            'queue_depth': self._size,
+                            'queue_wait': round(time.time() - enqueued_at, 3)
+                        }
+        return None
+    
+    def retry_after(self):
+        """估计队列腾出空位所需的秒数"""
+        with self._cond:
+            return max(1, math.ceil(self._avg_duration * (self._size + 1) / self.workers))
+    
+    def get_stats(self):
+        with self._cond:
+            return {
+                'mode': 'thread',
+                'workers': self.workers,
+                'running': self._running,
+                'queue_depth': self._size,
+                'max_queue': self.max_queue,
+                'clients': len(self._queues)
+            }
+
+class SQLiteJobQueue:
+    """基于SQLite的本地任务队列：API进程入队，独立的工作进程认领并执行
+    
+    与 TaskScheduler 接口一致；认领时按客户端轮询：job_clients 表记录每个客户端的轮次，
+    被认领或新开始排队的客户端排到最后，与 TaskScheduler 的出队顺序相同。
+    """
+    
+    def __init__(self, path, max_queue=SCHEDULER_MAX_QUEUE, max_per_client=SCHEDULER_MAX_QUEUED_PER_CLIENT):
+        self.path = path
+        self.max_queue = max_queue
+        self.max_per_client = max_per_client
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id TEXT NOT NULL,
+            client_id TEXT,
+            handler TEXT NOT NULL,
+            args TEXT NOT NULL,
+            status TEXT NOT NULL,
+            enqueued_at REAL NOT NULL,
+            started_at REAL,
+            worker TEXT
+        )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_task_id ON jobs (task_id)")
+        conn.execute("""CREATE TABLE IF NOT EXISTS job_clients (
+            client_id TEXT PRIMARY KEY,
+            turn INTEGER NOT NULL
+        )""")
+    
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    def submit(self, client_id, task_id, func, *args):
+        """入队，队列已满（总量或该客户端）时返回False；func须已在 JOB_HANDLERS 中注册"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            depth, client_depth = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(client_id = ?), 0) FROM jobs WHERE status = 'queued'",
+                (client_id,)).fetchone()
+            if depth >= self.max_queue or client_depth >= self.max_per_client:
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute(
+                "INSERT INTO jobs (task_id, client_id, handler, args, status, enqueued_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+                (task_id, client_id, func.__name__, json.dumps(args, ensure_ascii=False), time.time()))
+            if client_depth == 0:
+                # 客户端开始排队，排到轮询的最后
+                self._move_to_back(conn, client_id)
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    
+    def claim(self, worker):
+        """认领下一个任务，返回 (job_id, task_id, handler, args, enqueued_at)，队列为空时返回None"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 轮次最小的客户端的最早任务
+            row = conn.execute("""SELECT j.id, j.task_id, j.handler, j.args, j.enqueued_at, j.client_id
+                FROM jobs j LEFT JOIN job_clients c ON c.client_id = COALESCE(j.client_id, '')
+                WHERE j.status = 'queued'
+                ORDER BY COALESCE(c.turn, 0), j.id LIMIT 1""").fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET status = 'running', started_at = ?, worker = ? WHERE id = ?",
+                             (time.time(), worker, row[0]))
+                self._move_to_back(conn, row[5])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return row[0], row[1], row[2], json.loads(row[3]), row[4]
+    
+    def _move_to_back(self, conn, client_id):
+        conn.execute("""INSERT INTO job_clients (client_id, turn)
+            VALUES (?, (SELECT COALESCE(MAX(turn), 0) + 1 FROM job_clients))
+            ON CONFLICT (client_id) DO UPDATE SET turn = excluded.turn""", (client_id or '',))
+    
+    def finish(self, job_id, status='done'):
+        self._conn().execute("UPDATE jobs SET status = ? WHERE id = ?", (status, job_id))
+    
+    def fail_stale(self, timeout):
+        """将运行超时（工作进程可能已退出）的任务标记为失败，返回对应的task_id"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            before = time.time() - timeout
+            stale = [row[0] for row in conn.execute(
+                "SELECT task_id FROM jobs WHERE status = 'running' AND started_at < ?", (before,))]
+            conn.execute("UPDATE jobs SET status = 'failed' WHERE status = 'running' AND started_at < ?", (before,))
+            # 已结束的任务记录只保留一段时间
+            conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND enqueued_at < ?",
+                         (time.time() - TASK_TTL,))
+            conn.execute("""DELETE FROM job_clients WHERE client_id NOT IN (
+                SELECT COALESCE(client_id, '') FROM jobs WHERE status = 'queued')""")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return stale
+    
+    def queue_status(self, task_id):
+        """返回排队中任务的位置、队列深度与已等待时间，不在队列中时返回None"""
+        conn = self._conn()
+        row = conn.execute("SELECT id, enqueued_at FROM jobs WHERE task_id = ? AND status = 'queued'",
+                           (task_id,)).fetchone()
+        if row is None:
+            return None
+        position, depth = conn.execute(
+            "SELECT COALESCE(SUM(id <= ?), 0), COUNT(*) FROM jobs WHERE status = 'queued'", (row[0],)).fetchone()
+        return {
+            'queue_position': position,
+            'queue_depth': depth,
+            'queue_wait': round(time.time() - row[1], 3)
+        }
+    
+    def retry_after(self):
+        """按近期任务的平均耗时与当前队列深度估计重试等待时间"""
+        conn = self._conn()
+        depth = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        workers = conn.execute(
+            "SELECT COUNT(DISTINCT worker) FROM jobs WHERE started_at > ?", (time.time() - 600,)).fetchone()[0]
+        return max(1, math.ceil(30 * (depth + 1) / max(workers, 1)))
+    
+    def get_stats(self):
+        counts = dict(self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {
+            'mode': 'worker',
+            'running': counts.get('running', 0),
+            'queue_depth': counts.get('queued', 0),
+            'max_queue': self.max_queue
+        }
+
+def run_timed(stage, func, *args):
+    """执行函数并计时为一个阶段"""
+    with timing_span(stage):
+        return func(*args)
+
 # 执行搜索任务
 def execute_search(task_id, keyword, platforms, image_merge=False):
+    # 各阶段耗时汇总到本任务的 timings 字段
+    timings = TaskTimings()
+    timings_token = current_task_timings.set(timings)
+    task_id_token = current_task_id.set(task_id)
+    started = time.perf_counter()
     try:
-        tasks[task_id]['status'] = 'processing'
-        tasks[task_id]['progress'] = 0
-        tasks[task_id]['errors'] = []
+        update_task(task_id, status='processing', progress=0, errors=[])
         
         # 创建任务队列用于接收进度更新
         task_queue = queue.Queue()
@@ -1072,85 +2744,176 @@ def execute_search(task_id, keyword, platforms, image_merge=False):
                         # 根据平台类型调整总体进度
                         if update_type == 'bilibili_progress':
                             # B站部分占总进度的50%
-                            tasks[task_id]['progress'] = min(int(progress * 0.5), 45)
+                            update_task(task_id, progress=min(int(progress * 0.5), 45))
                         elif update_type == 'youtube_progress':
                             # YouTube部分占总进度的40%
-                            tasks[task_id]['progress'] = 50 + min(int(progress * 0.4), 36)
+                            update_task(task_id, progress=50 + min(int(progress * 0.4), 36))
                 except queue.Empty:
                     # 检查主任务是否已完成
-                    if tasks[task_id]['status'] != 'processing':
+                    task = task_store.get(task_id, with_results=False)
+                    if task is None or task['status'] != 'processing':
                         break
                 except Exception as e:
-                    print(f"进度更新线程错误: {e}")
+                    logger.warning("进度更新线程错误: %s", e)
         
         # 启动进度更新线程
-        updater_thread = threading.Thread(target=progress_updater)
+        updater_thread = threading.Thread(target=contextvars.copy_context().run, args=(progress_updater,))
         updater_thread.daemon = True
         updater_thread.start()
         
         all_videos = []
         total_platforms = len(platforms)
         processed_platforms = 0
+        completed_platforms = []
         
         with ThreadPoolExecutor(max_workers=len(platforms)) as executor:
-            futures = []
+            futures = {}
             
             if 'bilibili' in platforms:
-                futures.append((executor.submit(search_bilibili, keyword, task_id, task_queue), 'bilibili'))
+                futures[submit_with_context(executor, run_timed, 'bilibili', search_bilibili, keyword, task_id, task_queue)] = 'bilibili'
             if 'youtube' in platforms:
-                futures.append((executor.submit(search_youtube, keyword, task_id, task_queue), 'youtube'))
+                futures[submit_with_context(executor, run_timed, 'youtube', search_youtube, keyword, task_id, task_queue)] = 'youtube'
             
-            for future, platform in futures:
+            # 按完成顺序处理各平台结果
+            for future in as_completed(futures):
+                platform = futures[future]
                 try:
                     videos = future.result()
-                    # 确保每个平台的结果不超过30个
-                    videos = videos[:30]
+                    # 确保每个平台的结果不超过 MERGE_MAX_PER_PLATFORM 个
+                    videos = videos[:MERGE_MAX_PER_PLATFORM]
                     all_videos.extend(videos)
-                    processed_platforms += 1
-                    tasks[task_id]['progress'] = int((processed_platforms / total_platforms) * 100)
-                    print(f"{platform}搜索完成，获取到 {len(videos)} 个结果")
+                    logger.info("%s搜索完成，获取到 %s 个结果", platform, len(videos))
                 except Exception as e:
-                    tasks[task_id]['errors'].append(f"{platform}平台搜索失败: {str(e)}")
-        
-        print(f"两个平台共获取到 {len(all_videos)} 个视频")
+                    add_task_error(task_id, f"{platform}平台搜索失败: {str(e)}")
+                processed_platforms += 1
+                completed_platforms.append(platform)
+                
+                # 发布基于已完成平台的临时排名（仅标题匹配）；最后一个平台完成后同样发布，
+                # 使最终合并（含缩略图匹配时可能较慢）期间的临时排名与 completed_platforms 一致
+                with timing_span('merge_videos_partial'):
+                    partial_merged = format_results(merge_videos(all_videos)[:30])
+                update_task(
+                    task_id,
+                    # 所有平台完成后进度为90%（合并阶段）
+                    progress=int((processed_platforms / total_platforms) * 100) if processed_platforms < total_platforms else 90,
+                    results={
+                        'merged': partial_merged,
+                        'raw': list(all_videos)
+                    },
+                    completed_platforms=list(completed_platforms),
+                    partial=True,
+                    timings=timings.snapshot()
+                )
         
-        # 更新进度为90%（合并阶段）
-        tasks[task_id]['progress'] = 90
+        logger.info("两个平台共获取到 %s 个视频", len(all_videos))
         
         # 合并视频，传递image_merge参数
-        merged_videos = merge_videos(all_videos, image_merge)
+        with timing_span('merge_videos'):
+            merged_videos = merge_videos(all_videos, image_merge)
         
         # 按播放量降序排序所有结果
         merged_videos.sort(key=lambda x: x['total_views'], reverse=True)
         
         # 限制返回结果数量为30个
         final_results = merged_videos[:30]
-        print(f"排序后返回前30个视频，播放量最高的视频播放量为: {final_results[0]['total_views'] if final_results else 0}")
-        
-        # 更新进度为100%（完成所有工作）
-        tasks[task_id]['progress'] = 100
+        logger.info("排序后返回前30个视频，播放量最高的视频播放量为: %s", final_results[0]['total_views'] if final_results else 0)
         
         # 通知进度更新线程结束
         task_queue.put('DONE')
         
         # 格式化结果
-        for video in final_results:
-            video['formatted_total'] = format_number(video['total_views'])
-            for platform in video['platforms']:
-                video['platforms'][platform]['formatted_views'] = format_number(video['platforms'][platform]['views'])
-        
-        tasks[task_id]['status'] = 'completed'
-        tasks[task_id]['results'] = {
-            'merged': final_results,
-            'raw': all_videos
-        }
+        format_results(final_results)
+        
+        elapsed = time.perf_counter() - started
+        stage_latency.observe('total', elapsed)
+        timings.add('total', elapsed)
+        
+        # 更新进度为100%（完成所有工作），结果与状态同时写入
+        update_task(
+            task_id,
+            progress=100,
+            results={
+                'merged': final_results,
+                'raw': all_videos
+            },
+            partial=False,
+            completed_at=time.time(),
+            timings=timings.snapshot(),
+            status='completed'
+        )
+        # 任务完成后立即构建默认响应，之后的请求直接返回字节
+        get_completed_payload(task_id)
         
     except Exception as e:
-        tasks[task_id]['status'] = 'failed'
-        tasks[task_id]['error'] = str(e)
-        tasks[task_id]['traceback'] = traceback.format_exc()
+        update_task(task_id, status='failed', error=str(e), traceback=traceback.format_exc(),
+                    timings=timings.snapshot())
+    finally:
+        current_task_timings.reset(timings_token)
+        current_task_id.reset(task_id_token)
 
-import os
+# 搜索执行模式：'thread'（在API进程内的线程池执行）或 'worker'（入队到本地任务队列，由独立工作进程执行）
+SEARCH_EXECUTION_MODE = os.environ.get('SEARCH_EXECUTION_MODE', 'thread')
+JOB_DB_PATH = os.path.join(DATA_DIR, 'jobs.db')
+# 工作进程空闲时检查队列的间隔，以及判定任务执行超时（工作进程可能已退出）的时间
+WORKER_POLL_INTERVAL = 0.5
+WORKER_JOB_TIMEOUT = 600
+
+# 工作进程可执行的任务处理函数
+JOB_HANDLERS = {
+    'execute_search': execute_search
+}
+
+def create_search_scheduler(mode=None):
+    mode = mode or SEARCH_EXECUTION_MODE
+    if mode == 'thread':
+        return TaskScheduler()
+    if mode == 'worker':
+        return SQLiteJobQueue(JOB_DB_PATH)
+    raise ValueError(f"不支持的执行模式: {mode}")
+
+search_scheduler = create_search_scheduler()
+
+def run_search_worker():
+    """工作进程主循环：从任务队列认领任务并执行，结果写回共享的任务存储"""
+    job_queue = SQLiteJobQueue(JOB_DB_PATH)
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    logger.info("搜索工作进程 %s 已启动", worker)
+    last_stale_check = 0
+    while True:
+        try:
+            if time.time() - last_stale_check > 60:
+                for task_id in job_queue.fail_stale(WORKER_JOB_TIMEOUT):
+                    update_task(task_id, status='failed', error='搜索任务执行超时')
+                last_stale_check = time.time()
+            
+            job = job_queue.claim(worker)
+            if job is None:
+                time.sleep(WORKER_POLL_INTERVAL)
+                continue
+            
+            job_id, task_id, handler, args, enqueued_at = job
+            update_task(task_id, queue_wait=round(time.time() - enqueued_at, 3))
+            try:
+                JOB_HANDLERS[handler](*args)
+                job_queue.finish(job_id)
+            except Exception as e:
+                logger.exception("任务 %s 执行失败: %s", task_id, e)
+                update_task(task_id, status='failed', error=str(e), traceback=traceback.format_exc())
+                job_queue.finish(job_id, 'failed')
+        except Exception as e:
+            logger.exception("工作进程错误: %s", e)
+            time.sleep(WORKER_POLL_INTERVAL)
+
+def run_search_workers(processes):
+    """启动多个搜索工作进程（spawn方式，避免继承父进程的数据库连接与线程）"""
+    if TASK_STORE_BACKEND != 'sqlite':
+        raise SystemExit("工作进程模式需要共享的任务存储（TASK_STORE_BACKEND = 'sqlite'）")
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=run_search_worker, daemon=True) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
 
 # API路由
 @app.route('/')
@@ -1160,6 +2923,10 @@ def index():
     index_path = os.path.join(current_dir, 'index.html')
     return render_template_string(open(index_path, 'r', encoding='utf-8').read())
 
+def normalize_search_params(keyword, platforms, image_merge):
+    """归一化搜索参数，作为结果缓存与请求合并的键"""
+    return (' '.join(keyword.split()).lower(), tuple(sorted(set(platforms))), bool(image_merge))
+
 @app.route('/search', methods=['POST'])
 def search():
     data = request.json
@@ -1179,59 +2946,351 @@ def search():
     if not platforms:
         platforms = ['bilibili']
     
-    # 创建任务
-    task_id = f"task_{int(time.time())}_{int(time.time() * 1000) % 10000}"
-    tasks[task_id] = {
-        'id': task_id,
-        'keyword': keyword,
-        'platforms': platforms,
-        'image_merge': image_merge,  # 保存缩略图匹配合并选项
-        'status': 'pending',
-        'created_at': time.time()
-    }
-    
-    # 启动异步任务，传递image_merge参数
-    thread = threading.Thread(target=execute_search, args=(task_id, keyword, platforms, image_merge))
-    thread.daemon = True
-    thread.start()
+    search_key = normalize_search_params(keyword, platforms, image_merge)
+    with search_index_lock:
+        # 相同搜索正在进行或在缓存有效期内已完成，直接返回该任务
+        existing_id = search_index.get(search_key)
+        existing = task_store.get(existing_id, with_results=False) if existing_id else None
+        if existing is not None:
+            if existing['status'] in ('pending', 'processing'):
+                return jsonify({
+                    'message': '相同的搜索任务正在进行',
+                    'task_id': existing_id,
+                    'cached': True
+                })
+            if existing['status'] == 'completed' and time.time() - existing.get('completed_at', 0) < SEARCH_CACHE_TTL:
+                return jsonify({
+                    'message': '命中缓存的搜索结果',
+                    'task_id': existing_id,
+                    'cached': True
+                })
+        
+        # 创建任务
+        task_id = f"task_{int(time.time())}_{int(time.time() * 1000) % 10000}"
+        task_store.create({
+            'id': task_id,
+            'keyword': keyword,
+            'platforms': platforms,
+            'image_merge': image_merge,  # 保存缩略图匹配合并选项
+            'status': 'pending',
+            'created_at': time.time()
+        })
+        
+        # 提交到调度器，传递image_merge参数；队列已满时拒绝
+        if not search_scheduler.submit(request.remote_addr, task_id, execute_search,
+                                       task_id, keyword, platforms, image_merge):
+            discard_task(task_id)
+            response = jsonify({'error': '当前搜索任务过多，请稍后重试'})
+            response.headers['Retry-After'] = str(search_scheduler.retry_after())
+            return response, 429
+        search_index[search_key] = task_id
     
     return jsonify({
         'message': '搜索任务已开始',
-        'task_id': task_id
+        'task_id': task_id,
+        'cached': False
     })
 
-@app.route('/task/<task_id>', methods=['GET'])
-def get_task(task_id):
-    if task_id not in tasks:
-        return jsonify({'error': '任务不存在'}), 404
+# 处理可能包含的NumPy数组，转换为可序列化的格式
+def convert_numpy_objects(obj):
+    if isinstance(obj, dict):
+        return {key: convert_numpy_objects(value) for key, value in obj.items()}
+    elif isinstance(obj, list):
+        return [convert_numpy_objects(item) for item in obj]
+    elif isinstance(obj, np.ndarray):
+        return obj.tolist()  # 将NumPy数组转换为Python列表
+    elif isinstance(obj, (np.int64, np.int32, np.float64, np.float32)):
+        return obj.item()  # 将NumPy标量转换为Python标量
+    else:
+        return obj
+
+def serialize_task(task_id, include=(), offset=0, limit=None):
+    """生成任务的可序列化副本，任务不存在时返回None
     
-    task = tasks[task_id].copy()
+    include 可包含 'raw'（返回原始视频列表）与 'vectors'（原始视频保留缩略图特征）；
+    offset/limit 对 merged 与 raw 列表分页。
+    """
+    # 缩略图特征只在 include=raw,vectors 时读取
+    task = task_store.get(task_id, with_features='raw' in include and 'vectors' in include)
+    if task is None:
+        return None
     
     # 不返回敏感信息
     task.pop('traceback', None)
     
-    # 处理可能包含的NumPy数组，转换为可序列化的格式
-    def convert_numpy_objects(obj):
-        if isinstance(obj, dict):
-            return {key: convert_numpy_objects(value) for key, value in obj.items()}
-        elif isinstance(obj, list):
-            return [convert_numpy_objects(item) for item in obj]
-        elif isinstance(obj, np.ndarray):
-            return obj.tolist()  # 将NumPy数组转换为Python列表
-        elif isinstance(obj, (np.int64, np.int32, np.float64, np.float32)):
-            return obj.item()  # 将NumPy标量转换为Python标量
-        else:
-            return obj
+    # 排队中的任务附带队列位置、深度与等待时间
+    if task.get('status') == 'pending':
+        queue_status = search_scheduler.queue_status(task_id)
+        if queue_status:
+            task.update(queue_status)
+    
+    results = task.get('results')
+    if results:
+        end = offset + limit if limit is not None else None
+        projected = {'merged': results.get('merged', [])[offset:end]}
+        pagination = {'merged': {'offset': offset, 'limit': limit, 'total': len(results.get('merged', []))}}
+        if 'raw' in include:
+            raw = results.get('raw', [])[offset:end]
+            if 'vectors' not in include:
+                raw = [{key: value for key, value in video.items() if key not in THUMBNAIL_FEATURE_FIELDS}
+                       for video in raw]
+            projected['raw'] = raw
+            pagination['raw'] = {'offset': offset, 'limit': limit, 'total': len(results.get('raw', []))}
+        task['results'] = projected
+        task['pagination'] = pagination
     
     # 转换任务对象中的NumPy对象
-    task = convert_numpy_objects(task)
+    return convert_numpy_objects(task)
+
+def parse_task_query(args):
+    """解析任务查询参数：include（逗号分隔）、offset、limit"""
+    include = tuple(sorted(item.strip() for item in args.get('include', '').split(',') if item.strip()))
+    offset = max(args.get('offset', 0, type=int), 0)
+    limit = args.get('limit', None, type=int)
+    if limit is not None:
+        limit = max(limit, 0)
+    return include, offset, limit
+
+def task_etag(task_id, status, *query):
+    """基于任务版本号、排队位置与查询参数生成ETag，无需序列化任务"""
+    queue_status = search_scheduler.queue_status(task_id) if status == 'pending' else None
+    position = queue_status['queue_position'] if queue_status else None
+    key = repr((task_id, task_store.get_version(task_id), position, query))
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+def dumps_json(obj):
+    """将对象编码为UTF-8 JSON字节，优先使用orjson"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(convert_numpy_objects(obj), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def loads_json(data):
+    """解析JSON文本或字节，优先使用orjson"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# 已完成任务的预序列化响应缓存：(task_id, 查询参数) -> {编码: 字节}
+COMPLETED_PAYLOAD_CACHE_SIZE = 256
+completed_payloads = OrderedDict()
+completed_payloads_lock = threading.Lock()
+
+def get_completed_payload(task_id, query=((), 0, None)):
+    """获取已完成任务的预序列化（并预压缩）响应，首次请求时构建"""
+    key = (task_id, query)
+    with completed_payloads_lock:
+        payload = completed_payloads.get(key)
+        if payload is not None:
+            completed_payloads.move_to_end(key)
+            return payload
+    
+    task = serialize_task(task_id, *query)
+    if task is None:
+        return None
+    body = dumps_json(task)
+    payload = {'identity': body, 'gzip': gzip.compress(body, compresslevel=6)}
+    if brotli is not None:
+        payload['br'] = brotli.compress(body, quality=5)
     
-    return jsonify(task)
+    with completed_payloads_lock:
+        completed_payloads[key] = payload
+        while len(completed_payloads) > COMPLETED_PAYLOAD_CACHE_SIZE:
+            completed_payloads.popitem(last=False)
+    return payload
+
+def discard_completed_payloads(task_id):
+    with completed_payloads_lock:
+        for key in [key for key in completed_payloads if key[0] == task_id]:
+            del completed_payloads[key]
+
+@app.route('/task/<task_id>', methods=['GET'])
+def get_task(task_id):
+    meta = task_store.get(task_id, with_results=False)
+    if meta is None:
+        return jsonify({'error': '任务不存在'}), 404
+    
+    query = parse_task_query(request.args)
+    etag = task_etag(task_id, meta['status'], *query)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    
+    # 已完成的任务不再变化，直接返回预序列化并按Accept-Encoding选择压缩格式的字节
+    if meta['status'] == 'completed':
+        payload = get_completed_payload(task_id, query)
+        if payload is not None:
+            encoding = request.accept_encodings.best_match([e for e in ('br', 'gzip') if e in payload])
+            response = Response(payload[encoding or 'identity'], mimetype='application/json')
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+            response.headers['Vary'] = 'Accept-Encoding'
+            response.headers['Cache-Control'] = 'no-cache'
+            response.set_etag(etag)
+            return response
+    
+    task = serialize_task(task_id, *query)
+    if task is None:
+        return jsonify({'error': '任务不存在'}), 404
+    
+    response = jsonify(task)
+    response.set_etag(etag)
+    # 允许浏览器缓存，但每次都需用ETag重新验证
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# SSE连接的心跳间隔；排队中的任务按较短间隔刷新队列位置
+SSE_HEARTBEAT_INTERVAL = 15
+SSE_QUEUE_REFRESH_INTERVAL = 2
+# 任务存储可被其他进程更新时，SSE连接检查存储的间隔
+SSE_STORE_POLL_INTERVAL = 1
+
+def task_updates_from_other_processes():
+    """任务是否可能由其他进程更新（工作进程模式或多个API进程共享存储），此时本进程收不到更新通知"""
+    return task_store.shared and (SEARCH_EXECUTION_MODE == 'worker' or TASK_STORE_MULTIPROCESS)
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/task/<task_id>/stream', methods=['GET'])
+def stream_task(task_id):
+    """以Server-Sent Events推送任务进度、错误与最终结果"""
+    if not task_store.exists(task_id):
+        return jsonify({'error': '任务不存在'}), 404
+    
+    def generate():
+        condition = get_task_condition(task_id)
+        last_state = None
+        sent_errors = 0
+        sent_partial = None
+        last_sent = time.time()
+        while True:
+            events = []
+            finished = False
+            with condition:
+                task = task_store.get(task_id, with_results=False)
+                if task is None:
+                    events.append(format_sse('failed', {'error': '任务不存在'}))
+                    finished = True
+                else:
+                    status = task.get('status')
+                    state = {'status': status, 'progress': task.get('progress', 0)}
+                    if status == 'pending':
+                        state.update(search_scheduler.queue_status(task_id) or {})
+                    if state != last_state:
+                        events.append(format_sse('progress', state))
+                        last_state = state
+                    
+                    # 部分平台完成时推送临时排名
+                    completed_platforms = task.get('completed_platforms')
+                    if task.get('partial') and completed_platforms != sent_partial:
+                        results = (task_store.get(task_id) or {}).get('results') or {}
+                        events.append(format_sse('partial', {
+                            'merged': results.get('merged', []),
+                            'completed_platforms': completed_platforms
+                        }))
+                        sent_partial = completed_platforms
+                    
+                    errors = task.get('errors') or []
+                    if len(errors) > sent_errors:
+                        events.append(format_sse('errors', {'errors': errors}))
+                        sent_errors = len(errors)
+                    
+                    if status == 'completed':
+                        body = get_completed_payload(task_id)['identity'].decode('utf-8')
+                        events.append(f"event: completed\ndata: {body}\n\n")
+                        finished = True
+                    elif status == 'failed':
+                        events.append(format_sse('failed', {'error': task.get('error', '搜索任务失败')}))
+                        finished = True
+                
+                # 没有变化时等待任务更新，长时间无输出则发送心跳
+                if not events:
+                    timeout = SSE_QUEUE_REFRESH_INTERVAL if task.get('status') == 'pending' else SSE_HEARTBEAT_INTERVAL
+                    if task_updates_from_other_processes():
+                        timeout = min(timeout, SSE_STORE_POLL_INTERVAL)
+                    if condition.wait(timeout) or time.time() - last_sent < SSE_HEARTBEAT_INTERVAL:
+                        continue
+                    events.append(": keepalive\n\n")
+            
+            for event in events:
+                yield event
+            last_sent = time.time()
+            if finished:
+                return
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 @app.route('/platforms', methods=['GET'])
 def get_platforms():
     return jsonify({'platforms': SUPPORTED_PLATFORMS})
 
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    """运行时统计信息，便于调优"""
+    return jsonify({
+        'http_pools': get_http_pool_stats(),
+        'scheduler': search_scheduler.get_stats(),
+        'thumbnail_vector_cache': thumbnail_vector_cache.get_stats(),
+        'thumbnail_hash_cache': thumbnail_hash_cache.get_stats(),
+        'video_metadata_cache': video_metadata_cache.get_stats(),
+        'youtube_search_cache': youtube_search_cache.get_stats()
+    })
+
+def format_metric_labels(**labels):
+    """Prometheus标签格式，转义反斜杠、引号与换行"""
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{key}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus文本格式的运行指标（本进程）"""
+    lines = [
+        '# HELP video_rank_stage_duration_seconds 搜索任务各阶段耗时',
+        '# TYPE video_rank_stage_duration_seconds histogram'
+    ]
+    for stage, (counts, total, count) in sorted(stage_latency.snapshot().items()):
+        for bound, bucket_count in zip(stage_latency.buckets, counts):
+            lines.append(f"video_rank_stage_duration_seconds_bucket{format_metric_labels(stage=stage, le=bound)} {bucket_count}")
+        lines.append(f"video_rank_stage_duration_seconds_bucket{format_metric_labels(stage=stage, le='+Inf')} {count}")
+        lines.append(f"video_rank_stage_duration_seconds_sum{format_metric_labels(stage=stage)} {total}")
+        lines.append(f"video_rank_stage_duration_seconds_count{format_metric_labels(stage=stage)} {count}")
+    
+    lines += [
+        '# HELP video_rank_upstream_errors_total 上游请求失败次数（按主机与状态）',
+        '# TYPE video_rank_upstream_errors_total counter'
+    ]
+    with _upstream_errors_lock:
+        errors = sorted(upstream_errors.items())
+    for (host, status), count in errors:
+        lines.append(f"video_rank_upstream_errors_total{format_metric_labels(host=host, status=status)} {count}")
+    
+    scheduler_stats = search_scheduler.get_stats()
+    lines += [
+        '# HELP video_rank_active_tasks 正在执行的搜索任务数',
+        '# TYPE video_rank_active_tasks gauge',
+        f"video_rank_active_tasks {scheduler_stats['running']}",
+        '# HELP video_rank_queued_tasks 排队中的搜索任务数',
+        '# TYPE video_rank_queued_tasks gauge',
+        f"video_rank_queued_tasks {scheduler_stats['queue_depth']}",
+        '# HELP video_rank_threads 当前进程的线程数',
+        '# TYPE video_rank_threads gauge',
+        f"video_rank_threads {threading.active_count()}"
+    ]
+    return Response('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/quota', methods=['GET'])
+def get_quota():
+    """YouTube配额使用情况与剩余额度"""
+    return jsonify({'youtube': youtube_quota.get_stats()})
+
 # 404错误处理，确保API请求返回JSON格式
 @app.errorhandler(404)
 def not_found(error):
@@ -1240,6 +3299,9 @@ def not_found(error):
         request.path.startswith('/task/') or 
         request.path.startswith('/api/') or
         request.path.startswith('/platforms') or
+        request.path.startswith('/stats') or
+        request.path.startswith('/quota') or
+        request.path.startswith('/metrics') or
         'application/json' in request.headers.get('Accept', '')
     )
     
@@ -1252,11 +3314,22 @@ def not_found(error):
 # 清理过期任务
 def cleanup_tasks():
     while True:
-        now = time.time()
-        for task_id, task in list(tasks.items()):
-            # 清理30分钟前的任务
-            if now - task['created_at'] > 1800:
-                del tasks[task_id]
+        try:
+            # 清理超过保留时间的任务（一次按created_at索引的删除）
+            for task_id in task_store.expire(time.time() - TASK_TTL):
+                forget_task(task_id)
+            # 清理指向已删除任务的缓存索引与通知条件变量（任务可能已被其他进程清理）
+            with search_index_lock:
+                for search_key, task_id in list(search_index.items()):
+                    if not task_store.exists(task_id):
+                        del search_index[search_key]
+            with _task_conditions_lock:
+                task_ids = list(_task_conditions)
+            for task_id in task_ids:
+                if not task_store.exists(task_id):
+                    forget_task(task_id)
+        except Exception as e:
+            logger.warning("清理过期任务失败: %s", e)
         time.sleep(60)
 
 # 启动清理线程
@@ -1265,5 +3338,13 @@ cleanup_thread.daemon = True
 cleanup_thread.start()
 
 if __name__ == '__main__':
-    print(f"支持的平台: {SUPPORTED_PLATFORMS}")
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='视频播放量榜单')
+    parser.add_argument('--worker', type=int, metavar='N',
+                        help='启动N个搜索工作进程（配合 SEARCH_EXECUTION_MODE=worker 的API进程使用）')
+    cli_args = parser.parse_args()
+    
+    if cli_args.worker:
+        run_search_workers(cli_args.worker)
+    else:
+        logger.info("支持的平台: %s", SUPPORTED_PLATFORMS)
+        app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
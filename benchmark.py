@@ -0,0 +1,274 @@
+"""合并与图片处理热点路径的微基准测试
+
+完全离线运行：视频列表与缩略图均在本地合成，缩略图下载被替换为读取内存中的JPEG字节。
+结果以JSON输出，可保存后用 --baseline 与其他版本比较。
+
+用法：
+    python benchmark.py                        # 默认规模 30/300/3000，输出到标准输出
+    python benchmark.py --sizes 30,300 --repeat 3 --output bench.json
+    python benchmark.py --baseline bench.json  # 与之前的结果比较（比值输出到标准错误）
+    python benchmark.py --check-equivalence    # 同时检查快速解码与完整解码的向量等价性
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+import app
+
+# 合成标题使用的词表
+WORDS = [
+    'python', 'tutorial', 'music', 'live', 'official', 'video', 'game', 'review', 'guide', 'cover',
+    'remix', 'trailer', 'highlights', 'episode', 'full', 'course', 'beginner', 'advanced', 'dance', 'vlog',
+    'travel', 'cooking', 'news', 'reaction', 'mv', 'piano', 'guitar', 'anime', 'football', 'movie',
+]
+THUMBNAIL_SIZE = (320, 180)
+MATCH_RATIO = 0.3  # YouTube视频中与B站视频同名同图的比例
+
+class NullCache:
+    """不缓存任何内容，确保每次都执行完整的图片处理"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+class LocalResponse:
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+def make_thumbnail(rng, black_border=False):
+    """生成一张色块缩略图的JPEG字节，可选带上下黑边"""
+    w, h = THUMBNAIL_SIZE
+    blocks = rng.integers(0, 256, size=(9, 16, 3), dtype=np.uint8)
+    arr = np.kron(blocks, np.ones((h // 9 + 1, w // 16, 1), dtype=np.uint8))[:h, :w]
+    if black_border:
+        arr[:h // 8] = 0
+        arr[-h // 8:] = 0
+    buffer = io.BytesIO()
+    Image.fromarray(arr).save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+def make_videos(size, seed=0):
+    """生成每个平台 size 个视频及其缩略图（URL -> JPEG字节）"""
+    rng = np.random.default_rng(seed)
+    random_gen = random.Random(seed)
+    thumbnails = {}
+    bilibili, youtube = [], []
+
+    for i in range(size):
+        title = ' '.join(random_gen.sample(WORDS, random_gen.randint(3, 8))) + f" {i}"
+        url = f"https://bench.local/bilibili/{i}.jpg"
+        thumbnails[url] = make_thumbnail(rng, black_border=i % 4 == 0)
+        bilibili.append({
+            'title': title,
+            'url': f"https://www.bilibili.com/video/BV{i:010d}/",
+            'bv_id': f"BV{i:010d}",
+            'view_count': int(rng.integers(1000, 10 ** 8)),
+            'platform': 'bilibili',
+            'thumbnail_url': url
+        })
+
+    for i in range(size):
+        url = f"https://bench.local/youtube/{i}.jpg"
+        if random_gen.random() < MATCH_RATIO:
+            # 与某个B站视频同名、同缩略图
+            source = random_gen.choice(bilibili)
+            title = source['title']
+            thumbnails[url] = thumbnails[source['thumbnail_url']]
+        else:
+            title = ' '.join(random_gen.sample(WORDS, random_gen.randint(3, 8))) + f" yt{i}"
+            thumbnails[url] = make_thumbnail(rng, black_border=i % 5 == 0)
+        youtube.append({
+            'title': title,
+            'url': f"https://www.youtube.com/watch?v=yt{i:08d}",
+            'video_id': f"yt{i:08d}",
+            'view_count': int(rng.integers(1000, 10 ** 8)),
+            'platform': 'youtube',
+            'thumbnail_url': url
+        })
+    return bilibili, youtube, thumbnails
+
+def measure(func, repeat, warmup, setup=None):
+    """运行 warmup + repeat 次，返回每次计时（秒）；setup 的耗时不计入"""
+    timings = []
+    for run in range(warmup + repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        if run >= warmup:
+            timings.append(elapsed)
+    return timings
+
+def summarize(name, size, items, timings):
+    return {
+        'name': name,
+        'size': size,
+        'items': items,
+        'repeat': len(timings),
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+        'max': max(timings),
+        'per_item_us': statistics.median(timings) / max(items, 1) * 1e6
+    }
+
+def check_equivalence(size, urls):
+    """比较快速解码与完整解码路径得到的向量（余弦相似度）"""
+    similarities = []
+    for url in urls:
+        app.THUMBNAIL_FAST_DECODE = True
+        fast = app.get_image_vector(url)
+        app.THUMBNAIL_FAST_DECODE = False
+        full = app.get_image_vector(url)
+        similarities.append(float(np.dot(fast, full)))
+    app.THUMBNAIL_FAST_DECODE = True
+    return {
+        'size': size,
+        'images': len(similarities),
+        'min_cosine': min(similarities),
+        'median_cosine': statistics.median(similarities),
+        'tolerance': app.THUMBNAIL_FAST_DECODE_TOLERANCE,
+        'passed': min(similarities) >= app.THUMBNAIL_FAST_DECODE_TOLERANCE
+    }
+
+def run_benchmarks(sizes, repeat, warmup, skip_image_merge_above=None, equivalence=False):
+    results = []
+    equivalence_results = []
+    for size in sizes:
+        bilibili, youtube, thumbnails = make_videos(size)
+        videos = bilibili + youtube
+
+        # 缩略图“下载”改为读取本地生成的字节
+        app.http_get = lambda url, **kwargs: LocalResponse(thumbnails[url])
+        # 让所有视频参与匹配，且不因截止时间提前放弃缩略图
+        app.MERGE_MAX_PER_PLATFORM = size
+        app.THUMBNAIL_VECTOR_DEADLINE = 3600
+
+        # calculate_similarity：每个B站标题与对应位置的YouTube标题
+        pairs = list(zip([v['title'] for v in bilibili], [v['title'] for v in youtube]))
+        timings = measure(lambda: [app.calculate_similarity(a, b) for a, b in pairs], repeat, warmup)
+        results.append(summarize('calculate_similarity', size, len(pairs), timings))
+
+        # calculate_cosine_similarity：32×32×3 维向量对
+        rng = np.random.default_rng(1)
+        vectors = [(rng.random(3072).tolist(), rng.random(3072).tolist()) for _ in range(size)]
+        timings = measure(lambda: [app.calculate_cosine_similarity(a, b) for a, b in vectors], repeat, warmup)
+        results.append(summarize('calculate_cosine_similarity', size, len(vectors), timings))
+
+        # get_image_vector：解码、去黑边、缩放与归一化（不使用向量缓存）
+        app.thumbnail_vector_cache = NullCache()
+        urls = [v['thumbnail_url'] for v in bilibili]
+        timings = measure(lambda: [app.get_image_vector(url) for url in urls], repeat, warmup)
+        results.append(summarize('get_image_vector', size, len(urls), timings))
+
+        # 对照：完整分辨率解码后再去黑边
+        app.THUMBNAIL_FAST_DECODE = False
+        timings = measure(lambda: [app.get_image_vector(url) for url in urls], repeat, warmup)
+        results.append(summarize('get_image_vector_full_decode', size, len(urls), timings))
+        app.THUMBNAIL_FAST_DECODE = True
+
+        if equivalence:
+            equivalence_results.append(check_equivalence(size, [v['thumbnail_url'] for v in videos]))
+
+        # merge_videos：每次使用视频字典的新副本（合并会写入缩略图特征字段）
+        fresh_videos = lambda: ([dict(video) for video in videos],)
+        timings = measure(lambda v: app.merge_videos(v, image_merge=False), repeat, warmup, setup=fresh_videos)
+        results.append(summarize('merge_videos', size, len(videos), timings))
+
+        if skip_image_merge_above is None or size <= skip_image_merge_above:
+            timings = measure(lambda v: app.merge_videos(v, image_merge=True), repeat, warmup, setup=fresh_videos)
+            results.append(summarize('merge_videos_image_merge', size, len(videos), timings))
+    return results, equivalence_results
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+def compare(results, baseline_path):
+    """按 (name, size) 与基线结果比较中位数耗时，输出到标准错误"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r['name'], r['size']): r for r in json.load(f)['results']}
+    print(f"{'benchmark':<32}{'size':>6}{'baseline':>12}{'current':>12}{'ratio':>8}", file=sys.stderr)
+    for result in results:
+        base = baseline.get((result['name'], result['size']))
+        if base is None:
+            continue
+        ratio = result['median'] / base['median'] if base['median'] else float('inf')
+        print(f"{result['name']:<32}{result['size']:>6}{base['median']:>12.6f}{result['median']:>12.6f}{ratio:>8.2f}",
+              file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description='合并与图片处理热点路径的微基准测试')
+    parser.add_argument('--sizes', default='30,300,3000', help='每个平台的视频数量，逗号分隔')
+    parser.add_argument('--repeat', type=int, default=5, help='每项计时的重复次数')
+    parser.add_argument('--warmup', type=int, default=1, help='不计时的预热次数')
+    parser.add_argument('--skip-image-merge-above', type=int, metavar='N',
+                        help='规模大于N时跳过 merge_videos(image_merge=True)')
+    parser.add_argument('--output', help='结果JSON写入的文件，默认输出到标准输出')
+    parser.add_argument('--baseline', help='用于比较的之前的结果JSON')
+    parser.add_argument('--check-equivalence', action='store_true',
+                        help='检查快速解码与完整解码路径的向量等价性，超出容差时以非零状态退出')
+    parser.add_argument('--log-level', default='WARNING', help='基准运行期间应用日志的级别')
+    args = parser.parse_args()
+    app.logger.setLevel(args.log_level)
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    results, equivalence = run_benchmarks(sizes, args.repeat, args.warmup, args.skip_image_merge_above,
+                                          args.check_equivalence)
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'config': {
+            'sizes': sizes,
+            'repeat': args.repeat,
+            'warmup': args.warmup,
+            'thumbnail_size': list(THUMBNAIL_SIZE),
+            'thumbnail_match_method': app.THUMBNAIL_MATCH_METHOD,
+            'thumbnail_vector_workers': app.THUMBNAIL_VECTOR_WORKERS,
+            'thumbnail_draft_min_size': app.THUMBNAIL_DRAFT_MIN_SIZE,
+            'log_level': args.log_level,
+            'log_item_sample_rate': app.LOG_ITEM_SAMPLE_RATE
+        },
+        'results': results
+    }
+    if equivalence:
+        report['equivalence'] = equivalence
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+    if equivalence and not all(item['passed'] for item in equivalence):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
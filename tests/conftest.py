@@ -0,0 +1,7 @@
+import os
+import tempfile
+
+# 导入 app 之前把数据与缓存目录指向临时目录，测试不会写入仓库内的 data/ 与 cache/
+_test_dir = tempfile.mkdtemp(prefix='video-rank-tests-')
+os.environ.setdefault('VIDEO_RANK_DATA_DIR', os.path.join(_test_dir, 'data'))
+os.environ.setdefault('VIDEO_RANK_CACHE_DIR', os.path.join(_test_dir, 'cache'))
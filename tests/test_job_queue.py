@@ -0,0 +1,31 @@
+import os
+
+import app
+
+
+def noop(*args):
+    pass
+
+
+def test_claim_round_robin_per_client(tmp_path):
+    queue = app.SQLiteJobQueue(os.path.join(str(tmp_path), 'jobs.db'))
+    for index, client_id in enumerate(['a', 'a', 'a', 'b', 'b', 'c']):
+        assert queue.submit(client_id, f"{client_id}{index}", noop)
+
+    claimed = []
+    while True:
+        job = queue.claim('worker-1')
+        if job is None:
+            break
+        claimed.append(job[1][0])
+    assert claimed == ['a', 'b', 'c', 'a', 'b', 'a']
+
+
+def test_client_starting_to_queue_goes_to_back(tmp_path):
+    queue = app.SQLiteJobQueue(os.path.join(str(tmp_path), 'jobs.db'))
+    queue.submit('a', 'a1', noop)
+    queue.submit('a', 'a2', noop)
+    queue.submit('b', 'b1', noop)
+    assert queue.claim('worker-1')[1] == 'a1'
+    queue.submit('c', 'c1', noop)
+    assert [queue.claim('worker-1')[1] for _ in range(3)] == ['b1', 'a2', 'c1']
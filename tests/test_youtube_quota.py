@@ -0,0 +1,35 @@
+import os
+import time
+
+import app
+
+
+def repeated_search_units(monkeypatch, directory, daily_quota):
+    """搜索两次同一关键词，第二次之前让缓存过期，返回第二次搜索消耗的配额"""
+    ledger = app.YouTubeQuotaLedger(os.path.join(directory, 'quota.db'), daily_quota=daily_quota)
+    monkeypatch.setattr(app, 'youtube_quota', ledger)
+    for name in ('video_metadata_cache', 'youtube_search_cache'):
+        monkeypatch.setattr(app, name, app.TwoTierCache(name, ttl=3600, directory=directory, stale_ttl=86400))
+
+    async def fake_get_json(url, params=None, headers=None):
+        if url == app.YOUTUBE_API_URL:
+            return {'items': [{'id': {'videoId': f"v{i}"}} for i in range(50)], 'nextPageToken': 'next'}
+        return {'items': [{'id': video_id, 'snippet': {'title': video_id}, 'statistics': {'viewCount': '1'}}
+                          for video_id in params['id'].split(',')]}
+
+    monkeypatch.setattr(app, 'http_get_json_async', fake_get_json)
+    assert len(app.run_async(app.search_youtube_async('keyword', task_id='first'))) == 30
+
+    for cache in (app.video_metadata_cache, app.youtube_search_cache):
+        cache._memory.clear()
+        cache._get_db().execute("UPDATE cache SET expires_at = ?", (time.time() - 60,))
+        cache._get_db().commit()
+    assert len(app.run_async(app.search_youtube_async('keyword', task_id='second'))) == 30
+    return ledger.task_usage('second')['units']
+
+
+def test_degraded_mode_spends_less_than_normal(monkeypatch, tmp_path):
+    normal = repeated_search_units(monkeypatch, str(tmp_path / 'normal'), 10000)
+    degraded = repeated_search_units(monkeypatch, str(tmp_path / 'degraded'), app.YOUTUBE_QUOTA_DEGRADE_THRESHOLD - 1)
+    assert normal == 101
+    assert degraded == 0